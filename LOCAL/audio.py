@@ -0,0 +1,44 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+from LOCAL.utils import run_ffmpeg
+
+# per format: the source codecs it can take as they are, and how to encode the others
+FORMATS = {
+    "mp3": (("mp3",), ["-c:a", "libmp3lame", "-q:a", "0"]),
+    "flac": (("flac",), ["-c:a", "flac"]),
+    "wav": (("pcm_s16le", "pcm_s24le", "pcm_s32le", "pcm_f32le", "pcm_u8"), ["-c:a", "pcm_s16le"]),
+}
+
+def audio_args(fmt, codec):
+    """Codec options to make `fmt` out of an audio stream in `codec`, a copy when it fits."""
+    copy, encode = FORMATS[fmt]
+    return ["-c:a", "copy"] if codec in copy else encode
+
+async def extract_audio(path, outs, codec, duration=None, callback=None, run=run_ffmpeg):
+    """Writes the first audio stream of `path`, whose codec is `codec`, to each
+    (format, file) of `outs` in a single ffmpeg run. The source is decoded once
+    and shared by the encoders of all outputs, outputs it fits are copied.
+    Returns the formats that were copied."""
+    if not outs:
+        raise ValueError("No audio format asked for")
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path]
+    copied = []
+    for fmt, out in outs:
+        args = audio_args(fmt, codec)
+        if "copy" in args:
+            copied.append(fmt)
+        cmd += ["-map", "0:a:0", "-vn", "-sn", "-dn", "-map_metadata", "0"] + args + [out]
+    await run(cmd + ["-y"], duration, callback)
+    return copied
@@ -0,0 +1,64 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import os
+import math
+import asyncio
+
+# preset for a video whose pixels per core take about as long as SVT-AV1
+# preset 6 manages on 10 minutes of 1080p per core
+BASE_PRESET = 6
+BASE_WORK = 1920 * 1080 * 30 * 600
+FASTEST = 12
+SLOWEST = 4
+
+_encoders = None
+
+async def encoders():
+    """Names of the encoders the installed ffmpeg has, asked once."""
+    global _encoders
+    if _encoders is None:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-encoders",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await process.communicate()
+        # lines look like " V....D libx264   libx264 H.264 / AVC ..."
+        _encoders = {line.split()[1] for line in stdout.decode(errors="ignore").splitlines()
+                     if len(line.split()) > 1 and len(line.split()[0]) == 6}
+    return _encoders
+
+def av1_preset(width, height, duration, fps=30, load=0, cores=None):
+    """SVT-AV1 preset, from 4 (slow, small) to 12 (fast), for a video of this
+    size and length. Every doubling of the work per core over 10 minutes of
+    1080p goes one preset faster, and so does every queued job per slot,
+    so a busy bot gets through its queue."""
+    cores = cores or os.cpu_count() or 1
+    work = width * height * (fps or 30) * duration / cores
+    preset = BASE_PRESET + (math.log2(work / BASE_WORK) if work > 0 else 0)
+    preset += min(load, 3)
+    return int(min(max(round(preset), SLOWEST), FASTEST))
+
+async def av1_args(width, height, duration, fps=30, load=0, crf=35):
+    """libsvtav1 options for the video, or libaom-av1 ones on ffmpeg builds
+    that lack SVT-AV1, like the one Debian ships."""
+    preset = av1_preset(width, height, duration, fps, load)
+    if "libsvtav1" in await encoders():
+        return ["-c:v", "libsvtav1", "-preset", str(preset), "-crf", str(crf),
+                "-g", "240", "-pix_fmt", "yuv420p"]
+    # below cpu-used 6 libaom does a fraction of a frame a second on 1080p and
+    # holds an encode slot for hours, so it only goes faster from there
+    return ["-c:v", "libaom-av1", "-cpu-used", str(min(max(preset - 2, 6), 8)), "-crf", str(crf), "-b:v", "0",
+            "-row-mt", "1", "-tiles", "2x2", "-g", "240", "-pix_fmt", "yuv420p"]
@@ -0,0 +1,203 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import time
+import json
+import uuid
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+from LOCAL.utils import FFmpegProgress, run_ffmpeg
+
+class Broker(ABC):
+    """Queue between the bot and the encode workers.
+
+    The bot `submit`s ffmpeg jobs and polls their `status`, a worker `claim`s
+    the oldest one, `report`s its progress and ends it with `finish` or `fail`.
+    Jobs and results are plain JSON, so any store with an atomic pop can back
+    it; a job whose worker stopped reporting for `stale` seconds is handed out
+    again, and from then on only the new worker may report on it."""
+
+    @abstractmethod
+    async def submit(self, payload):
+        pass
+
+    @abstractmethod
+    async def claim(self, worker):
+        """Returns (job id, payload) of the next job, or None."""
+
+    @abstractmethod
+    async def report(self, id, worker, progress):
+        """Stores the progress of a job `worker` runs, returns False once it
+        was cancelled or handed to another worker."""
+
+    @abstractmethod
+    async def finish(self, id, worker, result):
+        pass
+
+    @abstractmethod
+    async def fail(self, id, worker, error):
+        pass
+
+    @abstractmethod
+    async def cancel(self, id):
+        pass
+
+    @abstractmethod
+    async def purge(self, age=24 * 3600):
+        """Forgets jobs that ended more than `age` seconds ago."""
+
+    @abstractmethod
+    async def status(self, id):
+        """Returns a dict with `state` (queued, running, done, failed or
+        cancelled), `progress`, `result` and `error`."""
+
+class SQLiteBroker(Broker):
+    """Broker on a SQLite file, for workers sharing a disk with the bot.
+    Every query waits on the file lock, so they run in a thread and not on
+    the event loop, one at a time on the shared connection."""
+
+    def __init__(self, path, stale=60):
+        self.stale = stale
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        # WAL needs shared memory, which a database on a disk shared between
+        # machines doesn't have; the rollback journal only needs file locks,
+        # and the timeout above waits on them
+        self.db.execute("PRAGMA journal_mode=DELETE")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL,
+            worker TEXT,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL)""")
+
+    async def _call(self, fn, *args):
+        def locked():
+            with self.lock:
+                return fn(*args)
+        return await asyncio.to_thread(locked)
+
+    async def _execute(self, query, params=()):
+        """Rows changed by `query`."""
+        return await self._call(lambda: self.db.execute(query, params).rowcount)
+
+    async def submit(self, payload):
+        id = uuid.uuid4().hex
+        now = time.time()
+        await self._execute("INSERT INTO jobs (id, payload, state, created, updated) VALUES (?, ?, 'queued', ?, ?)",
+                            (id, json.dumps(payload), now, now))
+        return id
+
+    def _claim(self, worker):
+        now = time.time()
+        # IMMEDIATE takes the write lock up front, two workers can't pick the same row
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute("SELECT id, payload FROM jobs WHERE state = 'queued' "
+                                  "OR (state = 'running' AND updated < ?) ORDER BY created LIMIT 1",
+                                  (now - self.stale,)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE jobs SET state = 'running', worker = ?, updated = ? WHERE id = ?",
+                                (worker, now, row[0]))
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        return row
+
+    async def claim(self, worker):
+        row = await self._call(self._claim, worker)
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    async def report(self, id, worker, progress):
+        return await self._execute("UPDATE jobs SET progress = ?, updated = ? "
+                                   "WHERE id = ? AND state = 'running' AND worker = ?",
+                                   (json.dumps(progress), time.time(), id, worker)) > 0
+
+    async def finish(self, id, worker, result):
+        await self._execute("UPDATE jobs SET state = 'done', result = ?, updated = ? "
+                            "WHERE id = ? AND state = 'running' AND worker = ?",
+                            (json.dumps(result), time.time(), id, worker))
+
+    async def fail(self, id, worker, error):
+        await self._execute("UPDATE jobs SET state = 'failed', error = ?, updated = ? "
+                            "WHERE id = ? AND state = 'running' AND worker = ?",
+                            (error, time.time(), id, worker))
+
+    async def cancel(self, id):
+        await self._execute("UPDATE jobs SET state = 'cancelled', updated = ? WHERE id = ? AND state IN ('queued', 'running')",
+                            (time.time(), id))
+
+    async def status(self, id):
+        row = await self._call(lambda: self.db.execute("SELECT state, progress, result, error FROM jobs WHERE id = ?",
+                                                       (id,)).fetchone())
+        if row is None:
+            return None
+        return {
+            "state": row[0],
+            "progress": json.loads(row[1]) if row[1] else None,
+            "result": json.loads(row[2]) if row[2] else None,
+            "error": row[3],
+        }
+
+    async def purge(self, age=24 * 3600):
+        await self._execute("DELETE FROM jobs WHERE state IN ('done', 'failed', 'cancelled') AND updated < ?",
+                            (time.time() - age,))
+
+def connect(url):
+    """Broker for `url`, like `sqlite:///jobs.db`."""
+    scheme, _, rest = url.partition("://")
+    if scheme == "sqlite":
+        # sqlite:///relative.db and sqlite:////absolute.db, as SQLAlchemy has it
+        return SQLiteBroker(rest[1:])
+    raise ValueError(f"Unknown broker {url}")
+
+def remote(broker, poll=1):
+    """A drop-in for `run_ffmpeg` that hands the command to a worker through
+    `broker` and follows its progress. Runs that pipe data in or out of ffmpeg
+    need the process next to them and still run here."""
+    async def run(cmd, duration=None, callback=None, interval=3, stdin=None, stdout=None):
+        if stdin is not None or stdout is not None:
+            return await run_ffmpeg(cmd, duration, callback, interval, stdin=stdin, stdout=stdout)
+        id = await broker.submit({"cmd": list(cmd), "duration": duration, "interval": interval})
+        progress = FFmpegProgress(duration)
+        last = 0
+        try:
+            while True:
+                await asyncio.sleep(poll)
+                status = await broker.status(id)
+                if status is None:
+                    raise Exception("The encode job disappeared from the queue")
+                if status["progress"]:
+                    progress.advance(status["progress"]["out_time"], status["progress"]["size"])
+                    if callback is not None and time.time() - last >= interval:
+                        last = time.time()
+                        await callback(progress)
+                if status["state"] == "done":
+                    return progress
+                if status["state"] in ("failed", "cancelled"):
+                    raise Exception(status["error"] or f"Encode job {status['state']}")
+        except BaseException:
+            await broker.cancel(id)
+            raise
+    return run
@@ -0,0 +1,184 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import os
+import math
+import time
+
+import numpy as np
+
+from LOCAL.utils import run_ffmpeg
+from LOCAL.probe import probe
+
+# frames analysed per video at most, and their size
+CANDIDATES = 400
+THUMB = (36, 64)
+BINS = 16
+
+class FrameReader:
+    """Cuts the rawvideo ffmpeg writes to stdout into frames of `shape`.
+
+    Frames are gathered in a ring of `ring` and handed over as a block with
+    `batch(frames, first)`, `first` being the number of the first one, so the
+    memory used stays the same however long the video is. Pass `write` as the
+    `stdout` of `run_ffmpeg` and call `flush` once it returned."""
+
+    def __init__(self, shape, batch, ring=64):
+        self.size = int(np.prod(shape))
+        self.ring = np.empty((ring,) + tuple(shape), np.uint8)
+        self.batch = batch
+        self.count = 0
+        self._flat = self.ring.reshape(ring, -1)
+        self._filled = 0
+        self._partial = 0
+
+    async def write(self, chunk):
+        data = np.frombuffer(chunk, np.uint8)
+        while len(data):
+            take = min(len(data), self.size - self._partial)
+            self._flat[self._filled, self._partial:self._partial + take] = data[:take]
+            data = data[take:]
+            self._partial += take
+            if self._partial == self.size:
+                self._partial = 0
+                self._filled += 1
+                self.count += 1
+                if self._filled == len(self.ring):
+                    self.flush()
+
+    def flush(self):
+        if self._filled:
+            self.batch(self.ring[:self._filled], self.count - self._filled)
+            self._filled = 0
+
+def frame_times(path):
+    """Seconds of every frame listed in the framecrc file at `path`."""
+    base, times = None, []
+    with open(path) as f:
+        for line in f:
+            if line.startswith("#tb 0:"):
+                num, den = line.split(":", 1)[1].strip().split("/")
+                base = int(num) / int(den)
+            elif line.strip() and not line.startswith("#"):
+                # stream, dts, pts, duration, size, crc
+                times.append(int(line.split(",")[2]) * base)
+    return times
+
+def features(frames):
+    """Quality and normalised gray histogram of every frame in `frames`.
+    Quality grows with the contrast and is cut for frames that are nearly
+    black, white or flat, like fades and title cards."""
+    flat = frames.reshape(len(frames), -1)
+    mean = flat.mean(axis=1)
+    std = flat.std(axis=1)
+    quality = np.clip(std / 64, 0, 1)
+    quality[(mean < 24) | (mean > 232) | (std < 8)] *= 0.05
+    bins = (flat >> 4).astype(np.int64) + np.arange(len(frames))[:, None] * BINS
+    hist = np.bincount(bins.ravel(), minlength=len(frames) * BINS).reshape(len(frames), BINS)
+    return quality + 1e-3, hist / flat.shape[1]
+
+def choose(quality, hist, count):
+    """Indexes of `count` frames, each the best trade of quality against
+    the histogram distance to the ones picked before it, in order."""
+    picked = [int(np.argmax(quality))]
+    distance = np.full(len(quality), np.inf)
+    while len(picked) < min(count, len(quality)):
+        # half the L1 distance of two histograms is between 0 and 1
+        distance = np.minimum(distance, np.abs(hist - hist[picked[-1]]).sum(axis=1) / 2)
+        score = quality * distance
+        score[picked] = -1
+        picked.append(int(np.argmax(score)))
+    return sorted(picked)
+
+async def best_times(path, count, run=run_ffmpeg):
+    """Times of the `count` most telling keyframes of `path`.
+
+    Only keyframes are decoded, at most about CANDIDATES of them and straight
+    to a small gray picture, and scored as they come out of ffmpeg. The times
+    returned are the timestamps of the frames scored, which the decoder gives
+    alongside them, as it may skip or add some to the keyframes ffprobe lists."""
+    keyframes = (await probe(path, keyframes=True))["keyframes"]
+    if not keyframes:
+        return []
+    step = max(1, math.ceil(len(keyframes) / CANDIDATES))
+    quality, hist = [], []
+
+    def batch(frames, first):
+        q, h = features(frames)
+        quality.append(q)
+        hist.append(h)
+
+    reader = FrameReader(THUMB, batch)
+    # the same frames go to a framecrc listing, which keeps their timestamps
+    stamps = f"{os.path.splitext(path)[0]}_pts_{time.time_ns()}.txt"
+    try:
+        await run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-skip_frame", "nokey", "-i", path,
+                   "-filter_complex", f"[0:v:0]select='not(mod(n,{step}))',scale={THUMB[1]}:{THUMB[0]},"
+                                      "format=gray,split[raw][pts]",
+                   "-map", "[raw]", "-vsync", "0", "-f", "rawvideo", "pipe:1",
+                   "-map", "[pts]", "-vsync", "0", "-f", "framecrc", stamps, "-y"], stdout=reader.write)
+        reader.flush()
+        times = frame_times(stamps)
+    finally:
+        if os.path.isfile(stamps):
+            os.remove(stamps)
+    if not quality:
+        return []
+    picked = choose(np.concatenate(quality), np.concatenate(hist), count)
+    return [max(times[i], 0.0) for i in picked if i < len(times)]
+
+async def contact_sheet(path, out, count=16, columns=4, width=320, pad=6, run=run_ffmpeg):
+    """Writes a JPEG grid of `count` frames of `path`, spread over its length
+    and stamped with their time, to `out`.
+
+    The frames are keyframes decoded in one ffmpeg run at thumbnail size and
+    copied into the preallocated sheet as they arrive; the sheet goes back to
+    ffmpeg as rawvideo to be encoded. Returns the number of frames on it."""
+    info = await probe(path, keyframes=True)
+    keyframes = info["keyframes"]
+    if not keyframes or not info["width"] or not info["height"]:
+        raise ValueError("No frames to make a contact sheet of")
+    count = min(count, len(keyframes))
+    # first and last keyframes tend to be titles and credits
+    picked = sorted({int(len(keyframes) * (i + 0.5) / count) for i in range(count)})
+    height = max(2, round(width * info["height"] / info["width"] / 2) * 2)
+    rows = math.ceil(len(picked) / columns)
+    sheet = np.full((pad + rows * (height + pad), pad + columns * (width + pad), 3), 24, np.uint8)
+
+    def batch(frames, first):
+        for k, frame in enumerate(frames, first):
+            if k >= len(picked):
+                return
+            y = pad + (k // columns) * (height + pad)
+            x = pad + (k % columns) * (width + pad)
+            sheet[y:y + height, x:x + width] = frame
+
+    reader = FrameReader((height, width, 3), batch, ring=4)
+    select = "+".join(f"eq(n,{i})" for i in picked)
+    stamp = (f"drawtext=text='%{{pts\\:hms}}':x=w-tw-6:y=h-th-6:fontsize={max(12, height // 10)}"
+             ":fontcolor=white:box=1:boxcolor=black@0.6:boxborderw=4")
+    await run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-skip_frame", "nokey", "-i", path,
+               "-map", "0:v:0", "-vf", f"select='{select}',scale={width}:{height},setsar=1,{stamp},format=rgb24",
+               "-vsync", "0", "-f", "rawvideo", "pipe:1"], stdout=reader.write)
+    reader.flush()
+
+    async def data():
+        raw = memoryview(sheet.reshape(-1))
+        for i in range(0, len(raw), 1024 * 1024):
+            yield bytes(raw[i:i + 1024 * 1024])
+
+    await run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+               "-s", f"{sheet.shape[1]}x{sheet.shape[0]}", "-i", "pipe:0", "-frames:v", "1", "-q:v", "3",
+               out, "-y"], stdin=data())
+    return min(reader.count, len(picked))
@@ -0,0 +1,32 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+HEIGHTS = [240, 360, 480, 720]
+
+def rungs(height):
+    """The ladder heights below a source `height`."""
+    return [h for h in HEIGHTS if h < height]
+
+def ladder_cmd(path, outs, video_args, audio_args):
+    """ffmpeg command decoding `path` once and writing one rendition per
+    (height, file) of `outs`: split hands the same frames to a scaler and an
+    encoder per height, the audio options are applied to each output."""
+    graph = f"[0:v:0]split={len(outs)}" + "".join(f"[s{i}]" for i in range(len(outs)))
+    for i, (height, _) in enumerate(outs):
+        # -2 keeps the width even, as the encoders need
+        graph += f";[s{i}]scale=-2:{height}[v{i}]"
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path, "-filter_complex", graph]
+    for i, (_, out) in enumerate(outs):
+        cmd += ["-map", f"[v{i}]", "-map", "0:a:0?"] + video_args + audio_args + ["-movflags", "+faststart", out]
+    return cmd + ["-y"]
@@ -0,0 +1,164 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import os
+import json
+import asyncio
+from collections import OrderedDict
+
+class ProbeError(Exception):
+    pass
+
+def _rate(value):
+    try:
+        num, _, den = value.partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError, AttributeError):
+        return 0.0
+
+def _float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def stream_header(head):
+    """Bytes from the start of the file that ffprobe needs to read its streams,
+    given the first bytes `head` of it. None when the container can't be read
+    front to back, like an MP4 with its moov atom after the media data."""
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        # Matroska and WebM, the tracks are described right after the EBML header
+        return 2 * 1024 * 1024
+    if len(head) > 188 and head[0] == head[188] == 0x47:
+        # MPEG-TS packets are self-contained
+        return 2 * 1024 * 1024
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], "big")
+        kind = head[offset + 4:offset + 8]
+        if size == 1 and offset + 16 <= len(head):
+            size = int.from_bytes(head[offset + 8:offset + 16], "big")
+        if kind == b"moov" and size:
+            return offset + size
+        if kind == b"mdat" or size < 8:
+            return None
+        offset += size
+    return None
+
+class MediaProbe:
+    """Async ffprobe with a concurrency cap and a cache keyed by path, size and mtime.
+
+    `await probe(path)` returns a dict with `width`, `height`, `duration` (float
+    seconds), `fps`, the codecs, the raw `streams` and `format`, and with
+    `keyframes=True` also the keyframe timestamps of the first video stream."""
+
+    def __init__(self, concurrency=2, size=128):
+        self.concurrency = concurrency
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._running = {}
+        self._sem = None
+
+    async def _ffprobe(self, *args):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+        async with self._sem:
+            process = await asyncio.create_subprocess_exec(
+                "ffprobe", "-v", "error", *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise ProbeError(stderr.decode(errors="ignore").strip() or f"ffprobe exited with code {process.returncode}")
+        return stdout.decode(errors="ignore")
+
+    async def _info(self, path):
+        data = json.loads(await self._ffprobe("-show_streams", "-show_format", "-of", "json", path) or "{}")
+        streams = data.get("streams", [])
+        fmt = data.get("format", {})
+        video = next((s for s in streams if s.get("codec_type") == "video"
+                      and not s.get("disposition", {}).get("attached_pic")), {})
+        audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+        duration = _float(fmt.get("duration")) or _float(video.get("duration")) or _float(audio.get("duration"))
+        return {
+            "path": path,
+            "format": fmt.get("format_name", ""),
+            "duration": duration,
+            "size": int(_float(fmt.get("size"))),
+            "bit_rate": int(_float(fmt.get("bit_rate"))),
+            "width": int(video.get("width", 0)),
+            "height": int(video.get("height", 0)),
+            "fps": _rate(video.get("avg_frame_rate")) or _rate(video.get("r_frame_rate")),
+            "video_codec": video.get("codec_name"),
+            "audio_codec": audio.get("codec_name"),
+            "pix_fmt": video.get("pix_fmt"),
+            "has_b_frames": int(video.get("has_b_frames", 0)),
+            "streams": streams,
+            "raw_format": fmt,
+            "keyframes": None,
+        }
+
+    async def _keyframes(self, path, *extra):
+        # packet flags only, nothing gets decoded
+        out = await self._ffprobe("-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+                                  *extra, "-of", "csv=p=0", path)
+        times = []
+        for line in out.splitlines():
+            pts, _, flags = line.partition(",")
+            if "K" in flags and pts not in ("", "N/A"):
+                times.append(float(pts))
+        return sorted(times)
+
+    async def keyframes_between(self, path, ranges):
+        """Keyframe timestamps in the (start, end) `ranges`, each from the last
+        one before its start, reading only those parts of the file. Not cached."""
+        # the demuxer seeks to the keyframe before each start, so it is included
+        intervals = ",".join(f"{start}%{end}" for start, end in ranges)
+        return sorted(set(await self._keyframes(path, "-read_intervals", intervals)))
+
+    async def __call__(self, path, keyframes=False):
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            raise ProbeError(str(e))
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        info = self._cache.get(key)
+        if info is not None and (info["keyframes"] is not None or not keyframes):
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return info
+        self.misses += 1
+        # concurrent callers for the same file share one ffprobe run
+        task = self._running.get((key, keyframes))
+        if task is None:
+            task = asyncio.ensure_future(self._probe(key, path, info, keyframes))
+            self._running[(key, keyframes)] = task
+            task.add_done_callback(lambda _: self._running.pop((key, keyframes), None))
+        return await asyncio.shield(task)
+
+    async def _probe(self, key, path, info, keyframes):
+        if info is None:
+            info = await self._info(path)
+        if keyframes:
+            info["keyframes"] = await self._keyframes(path)
+        self._cache[key] = info
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+        return info
+
+probe = MediaProbe(max(2, (os.cpu_count() or 1) // 2))
@@ -0,0 +1,143 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import os
+import time
+import shutil
+import asyncio
+from bisect import bisect_left
+
+from LOCAL.utils import FFmpegProgress, run_ffmpeg
+from LOCAL.probe import probe
+from LOCAL.streams import streams_of
+
+# shorter segments cost more in encoder warm-up than they win in parallelism
+MIN_SEGMENT = 20
+
+def split_points(keyframes, duration, count):
+    """Keyframe times closest to cutting `duration` into `count` equal parts."""
+    points = []
+    for i in range(1, count):
+        target = duration * i / count
+        j = bisect_left(keyframes, target)
+        near = keyframes[max(j - 1, 0):j + 1]
+        if not near:
+            continue
+        t = min(near, key=lambda t: abs(t - target))
+        if t > (points[-1] if points else 0) and t < duration:
+            points.append(t)
+    return points
+
+def segment_count(duration, workers):
+    """How many segments to cut a `duration` long video into, 0 when one
+    ffmpeg run is the better choice. Twice the workers keeps every process
+    busy when some segments encode faster than others."""
+    if workers < 2:
+        return 0
+    count = min(workers * 2, int(duration // MIN_SEGMENT))
+    return count if count >= 2 else 0
+
+def source_maps(info, input=1):
+    """-map options taking from `input` the audio and subtitles ffmpeg picks
+    by itself from a single input: the audio with the most channels, the
+    first of them on a tie, and the first subtitles."""
+    maps = []
+    audio = streams_of(info, "audio")
+    if audio:
+        maps += ["-map", f"{input}:{max(audio, key=lambda s: s.get('channels') or 0)['index']}"]
+    subtitles = streams_of(info, "subtitle")
+    if subtitles:
+        maps += ["-map", f"{input}:{subtitles[0]['index']}"]
+    return maps
+
+def thread_args(video_args, threads):
+    # libx265 ignores -threads, its thread pool is sized through x265-params
+    if "libx265" in video_args:
+        return ["-x265-params", f"pools={threads}"]
+    return ["-threads", str(threads)]
+
+async def encode_segments(path, video_args, other_args, output, duration,
+                          workers=0, threads=2, callback=None, interval=3, stdout=None, run=run_ffmpeg):
+    """Encodes the video of `path` in segments cut at its keyframes, `workers` ffmpeg
+    processes of `threads` threads at a time (0 fills the CPU cores), and joins
+    them without re-encoding.
+
+    `video_args` are the ffmpeg options of the video encode, `other_args` the ones
+    for the audio and subtitles, applied once while joining to the same streams
+    a single run would take, and `output` ends the final
+    command (file name or `pipe:1` with `stdout`). `callback(progress)` gets the
+    progress of all segments together, and the segment encodes are started with
+    `run`, which can hand them to other machines. Returns False, without doing anything, when
+    the video is too short or has too few keyframes to be worth cutting."""
+    workers = workers or max(1, (os.cpu_count() or 1) // threads)
+    count = segment_count(duration, workers)
+    if not count:
+        return False
+    info = await probe(path, keyframes=True)
+    points = split_points(info["keyframes"], duration, count)
+    if not points:
+        return False
+    folder = f"{os.path.splitext(path)[0]}_segments_{time.time_ns()}"
+    os.makedirs(folder)
+    try:
+        # cut at the keyframes we picked, a hair early so rounding can't skip one
+        await run_ffmpeg(["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path,
+                          "-map", "0:v:0", "-c", "copy", "-f", "segment",
+                          "-segment_times", ",".join(f"{max(t - 0.001, 0):.3f}" for t in points),
+                          "-reset_timestamps", "1", os.path.join(folder, "part_%04d.mkv")])
+        parts = sorted(f for f in os.listdir(folder) if f.startswith("part_"))
+        # the muxer may not cut where we asked, go by what it wrote
+        lengths = [part["duration"] for part in await asyncio.gather(
+            *(probe(os.path.join(folder, part)) for part in parts))]
+        done = [0.0] * len(parts)
+        total = FFmpegProgress(duration)
+        pool = asyncio.Semaphore(workers)
+        last = 0
+
+        async def encode(i, part):
+            async def update(progress):
+                nonlocal last
+                done[i] = progress.out_time
+                total.advance(sum(done))
+                if callback is not None and time.time() - last >= interval:
+                    last = time.time()
+                    await callback(total)
+            async with pool:
+                await run(["ffmpeg", "-hide_banner", "-loglevel", "error",
+                                  "-i", os.path.join(folder, part)] + video_args
+                                 + thread_args(video_args, threads)
+                                 + ["-an", "-sn", os.path.join(folder, "enc_" + part), "-y"],
+                                 lengths[i], update, interval)
+            done[i] = lengths[i]
+            total.advance(sum(done))
+
+        tasks = [asyncio.ensure_future(encode(i, part)) for i, part in enumerate(parts)]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+        listing = os.path.join(folder, "list.txt")
+        with open(listing, "w") as f:
+            for part in parts:
+                f.write(f"file 'enc_{part}'\n")
+        # the audio comes from the source, in the single joining pass
+        await run_ffmpeg(["ffmpeg", "-hide_banner", "-loglevel", "error",
+                          "-f", "concat", "-safe", "0", "-i", listing, "-i", path,
+                          "-map", "0:v"] + source_maps(info) + ["-c:v", "copy"]
+                         + other_args + output, stdout=stdout)
+        return True
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
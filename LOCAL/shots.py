@@ -0,0 +1,113 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+"""Screenshots of a video, many per ffmpeg run.
+
+    python3 -m LOCAL.shots [video] --count 10
+
+benchmarks it against one ffmpeg per screenshot, on a generated test video
+when no file is given."""
+
+import os
+import time
+import shutil
+import asyncio
+import argparse
+
+from LOCAL.utils import run_ffmpeg
+
+# the old fixed spread, as fractions of the duration
+SPREAD = [1 / n for n in [8, 7, 6, 5, 4, 3, 2, 1.5, 1.25, 1.10]]
+
+def spread(duration, count=10):
+    """`count` timestamps over `duration`, the usual ten when that is the count."""
+    if count == len(SPREAD):
+        return [duration * f for f in SPREAD]
+    return [duration * (i + 1) / (count + 1) for i in range(count)]
+
+def batches(items, workers):
+    """`items` dealt round-robin into at most `workers` lists, so every batch
+    seeks over the whole file instead of one batch getting the far end."""
+    workers = max(1, min(workers, len(items)))
+    return [items[i::workers] for i in range(workers)]
+
+async def screenshots(path, times, folder, workers=2, callback=None, run=run_ffmpeg):
+    """Grabs a JPEG of `path` at each of `times` seconds into `folder`, which
+    has to be the caller's own. The frames are split over `workers` ffmpeg
+    runs; each opens the file once per frame with a keyframe seek (-ss before
+    -i) and writes all of its frames, so only the GOP before every frame gets
+    decoded. `callback(done)` is awaited as batches finish.
+    Returns (time, path) of the frames that were written, in the order of `times`."""
+    os.makedirs(folder, exist_ok=True)
+    jobs = [(t, os.path.join(folder, f"shot_{i:03d}.jpg")) for i, t in enumerate(times)]
+    done = 0
+
+    async def grab(batch):
+        nonlocal done
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+        for t, _ in batch:
+            cmd += ["-ss", f"{t:.3f}", "-i", path]
+        for i, (_, out) in enumerate(batch):
+            cmd += ["-map", f"{i}:v:0", "-frames:v", "1", "-q:v", "2", out]
+        try:
+            await run(cmd + ["-y"])
+        except Exception as e:
+            # a seek past the end fails the run, the frames before it are kept
+            print(e)
+        done += len(batch)
+        if callback is not None:
+            await callback(done)
+
+    await asyncio.gather(*(grab(batch) for batch in batches(jobs, workers)))
+    return [(t, out) for t, out in jobs if os.path.isfile(out)]
+
+async def one_by_one(path, times, folder):
+    """The old way, one ffmpeg per screenshot, for the benchmark."""
+    for i, t in enumerate(times):
+        await run_ffmpeg(["ffmpeg", "-hide_banner", "-loglevel", "error", "-ss", f"{t:.3f}",
+                          "-i", path, "-frames:v", "1", os.path.join(folder, f"old_{i:03d}.jpg"), "-y"])
+
+async def bench(path, count, workers, duration):
+    folder = f"shots_bench_{time.time_ns()}"
+    os.makedirs(folder)
+    try:
+        if path is None:
+            path = os.path.join(folder, "test.mp4")
+            await run_ffmpeg(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+                              "-i", f"testsrc2=size=1280x720:rate=30:duration={duration}",
+                              "-c:v", "libx264", "-preset", "ultrafast", "-g", "250", path, "-y"])
+        else:
+            from LOCAL.probe import probe
+            duration = (await probe(path))["duration"]
+        times = spread(duration, count)
+        started = time.time()
+        await one_by_one(path, times, folder)
+        old = time.time() - started
+        started = time.time()
+        got = await screenshots(path, times, os.path.join(folder, "new"), workers)
+        new = time.time() - started
+        print(f"{count} screenshots of {duration:.0f}s")
+        print(f"one ffmpeg each: {old:.2f}s")
+        print(f"{min(workers, count)} batched runs: {new:.2f}s ({len(got)} written, {old / new:.1f}x)")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screenshot benchmark")
+    parser.add_argument("video", nargs="?", help="video to use, a test video is generated without it")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--duration", type=int, default=600, help="length of the generated video")
+    args = parser.parse_args()
+    asyncio.run(bench(args.video, args.count, args.workers, args.duration))
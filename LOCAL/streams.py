@@ -0,0 +1,102 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+# codecs each container takes as they are, None for anything
+CONTAINERS = {
+    "mp4": {
+        "video": ("h264", "hevc", "av1", "vp9", "mpeg4"),
+        # flac and opus in MP4 want -strict experimental from older ffmpeg, like 4.3
+        "audio": ("aac", "mp3", "alac", "ac3", "eac3"),
+        "subtitle": ("mov_text",),
+    },
+    "webm": {
+        "video": ("vp8", "vp9", "av1"),
+        "audio": ("opus", "vorbis"),
+        "subtitle": ("webvtt",),
+    },
+    "mkv": {
+        "video": None,
+        "audio": None,
+        "subtitle": ("subrip", "ass", "ssa", "webvtt", "hdmv_pgs_subtitle", "dvd_subtitle", "dvb_subtitle"),
+    },
+}
+
+# what streams that don't fit are encoded to
+ENCODERS = {
+    "mp4": {
+        "video": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p"],
+        "audio": ["-c:a", "aac", "-b:a", "128k"],
+        "subtitle": ["-c:s", "mov_text"],
+    },
+    "webm": {
+        "video": ["-c:v", "libvpx-vp9", "-crf", "32", "-b:v", "0", "-row-mt", "1"],
+        "audio": ["-c:a", "libopus", "-b:a", "128k"],
+        "subtitle": ["-c:s", "webvtt"],
+    },
+    "mkv": {
+        "video": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23"],
+        "audio": ["-c:a", "aac", "-b:a", "128k"],
+        "subtitle": ["-c:s", "srt"],
+    },
+}
+
+TEXT_SUBTITLES = ("subrip", "ass", "ssa", "webvtt", "mov_text", "text")
+
+def streams_of(info, kind):
+    """The `kind` (video, audio or subtitle) streams of probed `info`, cover art left out."""
+    return [s for s in info["streams"] if s.get("codec_type") == kind
+            and not s.get("disposition", {}).get("attached_pic")]
+
+def fits(kind, codec, container):
+    allowed = CONTAINERS[container][kind]
+    return allowed is None or codec in allowed
+
+def codec_args(info, kind, container, encode=None):
+    """Codec options for the `kind` streams of `info` going into `container`:
+    a copy when all of them fit it, otherwise `encode` or its usual encoder."""
+    found = streams_of(info, kind)
+    if not found:
+        return []
+    if all(fits(kind, s.get("codec_name"), container) for s in found):
+        return [f"-c:{kind[0]}", "copy"]
+    if kind == "subtitle" and not all(s.get("codec_name") in TEXT_SUBTITLES for s in found):
+        # subtitles drawn as pictures can't be turned into text
+        return ["-sn"]
+    return encode or ENCODERS[container][kind]
+
+def plan(info, container, video=None, audio=None):
+    """Output options that put every stream of `info` into `container`, copying
+    what fits and encoding the rest, with `video` and `audio` as the encodes
+    to use for those. Returns (args, copy), `copy` being True when no video
+    or audio gets encoded and the run is about as fast as a remux."""
+    args = ["-map", "0:V?", "-map", "0:a?", "-map", "0:s?"]
+    copy = True
+    for kind, encode in (("video", video), ("audio", audio), ("subtitle", None)):
+        options = codec_args(info, kind, container, encode)
+        copy = copy and (kind == "subtitle" or options in ([], [f"-c:{kind[0]}", "copy"]))
+        args += options
+    return args, copy
+
+def same_container(info, container):
+    """Whether the file of `info` is already a `container` file holding only
+    streams that fit it, so it can be used as it is."""
+    # ffprobe names matroska and webm alike, the codecs tell them apart
+    if ("mp4" if container == "mp4" else "matroska") not in info["format"].split(","):
+        return False
+    # fonts and other attachments are matroska only, data streams we can't judge
+    if any(s.get("codec_type") not in ("video", "audio", "subtitle")
+           and not (container == "mkv" and s.get("codec_type") == "attachment") for s in info["streams"]):
+        return False
+    return all(fits(kind, s.get("codec_name"), container)
+               for kind in ("video", "audio", "subtitle") for s in streams_of(info, kind))
@@ -0,0 +1,133 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import os
+import math
+import time
+import shutil
+
+from LOCAL.utils import run_ffmpeg
+from LOCAL.streams import streams_of
+
+ENCODER = ["-c:v", "libx265", "-preset", "faster"]
+# the two CRFs every sample window is encoded at, and the range we pick from
+PROBE_CRFS = (24, 32)
+MIN_CRF = 16
+MAX_CRF = 40
+SAMPLES = 3
+SAMPLE_SECONDS = 5
+# share of the file left to the video once the container took its part
+OVERHEAD = 0.97
+# below this a video is not worth watching
+MIN_BITRATE = 64000
+
+FFMPEG = ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+
+def audio_bitrate(info, copied):
+    """Bits per second the audio will take, the source's when it is `copied`.
+    None when a copied stream doesn't tell its bitrate, it has to be encoded
+    then to know what is left for the video."""
+    audio = streams_of(info, "audio")
+    if not audio:
+        return 0
+    if not copied:
+        return 128000
+    tags = audio[0].get("tags") or {}
+    # matroska keeps it in the statistics tags mkvmerge writes
+    for value in [audio[0].get("bit_rate"), tags.get("BPS")] + [v for k, v in tags.items() if k.startswith("BPS-")]:
+        try:
+            if int(value) > 0:
+                return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def video_budget(size, duration, audio):
+    """Video bits per second that keep a `duration` long file under `size` bytes."""
+    if not duration or duration <= 0:
+        raise ValueError("The length of the video is unknown")
+    return size * 8 * OVERHEAD / duration - audio
+
+def predict_crf(samples, budget):
+    """CRF expected to give `budget` bits per second, from (crf, bitrate) `samples`.
+    Bitrate falls about exponentially with the CRF, so log(bitrate) is taken
+    as linear in it. None when the samples don't tell, like a still image."""
+    (c1, b1), (c2, b2) = samples
+    if b1 <= 0 or b2 <= 0 or b2 >= b1:
+        return None
+    slope = (math.log(b2) - math.log(b1)) / (c2 - c1)
+    return c1 + (math.log(budget) - math.log(b1)) / slope
+
+async def sample(path, duration, folder, run=run_ffmpeg):
+    """(crf, bits per second) of the video at both PROBE_CRFS, measured on
+    SAMPLES windows spread over it. The windows are decoded once, joined
+    and split to one encoder per CRF, all in a single ffmpeg run."""
+    cmd = list(FFMPEG)
+    for i in range(SAMPLES):
+        start = duration * (i + 1) / (SAMPLES + 1) - SAMPLE_SECONDS / 2
+        cmd += ["-ss", f"{max(start, 0):.3f}", "-t", str(SAMPLE_SECONDS), "-i", path]
+    graph = "".join(f"[{i}:v:0]" for i in range(SAMPLES)) + f"concat=n={SAMPLES}:v=1:a=0,split={len(PROBE_CRFS)}"
+    graph += "".join(f"[c{i}]" for i in range(len(PROBE_CRFS)))
+    cmd += ["-filter_complex", graph]
+    outs = [os.path.join(folder, f"sample_{crf}.mkv") for crf in PROBE_CRFS]
+    for i, (crf, out) in enumerate(zip(PROBE_CRFS, outs)):
+        cmd += ["-map", f"[c{i}]"] + ENCODER + ["-crf", str(crf), out]
+    await run(cmd + ["-y"])
+    seconds = SAMPLES * SAMPLE_SECONDS
+    return [(crf, os.path.getsize(out) * 8 / seconds) for crf, out in zip(PROBE_CRFS, outs)]
+
+async def encode_to_size(path, out, size, duration, info, other_args, callback=None, run=run_ffmpeg):
+    """Encodes `path` to `out` so that it stays under `size` bytes.
+
+    A few sample windows tell the CRF that fits the size, which is encoded
+    with the bitrate capped at the budget. When that still misses, or the
+    samples can't tell, the video is encoded in two passes at the budget.
+    `other_args` are the audio and subtitle options of the output, audio
+    that is copied needs a known bitrate.
+    Returns the CRF used, None after two passes; the caller checks the size
+    of `out`, two passes can still end a little over it."""
+    copied = "copy" in other_args[:2]
+    audio = audio_bitrate(info, copied)
+    if audio is None:
+        raise ValueError("The bitrate of the copied audio is unknown")
+    budget = video_budget(size, duration, audio)
+    if budget < MIN_BITRATE:
+        raise ValueError(f"{size} bytes are too few for {duration:.0f}s of video")
+    # relative, as workers mount the same directory, and without the colons of
+    # `out`'s timestamp, x265-params splits the stats path on them
+    folder = f"target_{time.time_ns()}"
+    os.makedirs(folder)
+    try:
+        crf = None
+        # short videos are cheaper to do in two passes than to sample
+        if duration >= SAMPLES * SAMPLE_SECONDS * 4:
+            crf = predict_crf(await sample(path, duration, folder, run), budget)
+        if crf is not None and crf <= MAX_CRF:
+            crf = round(min(max(crf, MIN_CRF), MAX_CRF), 1)
+            await run(FFMPEG + ["-i", path] + ENCODER
+                      + ["-crf", str(crf), "-maxrate", str(int(budget)), "-bufsize", str(int(budget * 2))]
+                      + other_args + [out, "-y"], duration, callback)
+            if os.path.getsize(out) <= size:
+                return crf
+        log = os.path.join(folder, "pass")
+        bitrate = str(int(budget))
+        await run(FFMPEG + ["-i", path, "-map", "0:v:0"] + ENCODER
+                  + ["-b:v", bitrate, "-x265-params", f"pass=1:stats={log}.log", "-an", "-f", "null", "-"],
+                  duration, callback)
+        await run(FFMPEG + ["-i", path] + ENCODER
+                  + ["-b:v", bitrate, "-x265-params", f"pass=2:stats={log}.log"]
+                  + other_args + [out, "-y"], duration, callback)
+        return None
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,147 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import os
+import time
+import shutil
+from bisect import bisect_left, bisect_right
+
+from LOCAL.utils import run_ffmpeg
+from LOCAL.probe import probe
+
+# encoders for the partial GOPs at the cut points, their output has to join
+# the stream-copied middle, so only codecs we can re-create are smart-cut
+ENCODERS = {
+    "h264": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-bsf:v", "h264_mp4toannexb"],
+    "hevc": ["-c:v", "libx265", "-preset", "veryfast", "-crf", "20", "-bsf:v", "hevc_mp4toannexb"],
+}
+
+FFMPEG = ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+
+def seconds(text):
+    """Seconds in `hh:mm:ss`, `mm:ss` or `ss`, each part may have decimals."""
+    total = 0.0
+    for part in str(text).strip().split(":"):
+        total = total * 60 + float(part)
+    if total < 0:
+        raise ValueError(f"Negative time {text}")
+    return total
+
+def ranges(text):
+    """(start, end) seconds of every `start-end` in `text`, separated by commas or lines."""
+    found = []
+    for item in str(text).replace("\n", ",").split(","):
+        if not item.strip():
+            continue
+        start, sep, end = item.partition("-")
+        if not sep:
+            raise ValueError(f"{item.strip()} is not a range")
+        start, end = seconds(start), seconds(end)
+        if end <= start:
+            raise ValueError(f"{item.strip()} ends before it starts")
+        found.append((start, end))
+    if not found:
+        raise ValueError("No range given")
+    return found
+
+def plan(keyframes, start, end):
+    """Pieces of [start, end) as (from, to, copy): the keyframe-aligned middle is
+    copied, the partial GOPs at both edges are encoded."""
+    first = bisect_left(keyframes, start)
+    last = bisect_right(keyframes, end) - 1
+    if first >= len(keyframes) or last < first or keyframes[first] >= keyframes[last]:
+        # no whole GOP inside the range
+        return [(start, end, False)]
+    pieces = []
+    if keyframes[first] > start:
+        pieces.append((start, keyframes[first], False))
+    pieces.append((keyframes[first], keyframes[last], True))
+    if end > keyframes[last]:
+        pieces.append((keyframes[last], end, False))
+    return pieces
+
+def _listing(folder, name, lines):
+    path = os.path.join(folder, name)
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+def _cuts(path, cuts):
+    # concat demuxer lines playing `path` from each start to end, in order
+    path = os.path.abspath(path).replace("'", "'\\''")
+    lines = []
+    for start, end in cuts:
+        lines += [f"file '{path}'", f"inpoint {start:.6f}", f"outpoint {end:.6f}"]
+    return lines
+
+async def smart_trim(path, out, cuts, run=run_ffmpeg):
+    """Cuts the (start, end) seconds ranges `cuts` out of `path` at the exact
+    frames and joins them, in the given order, into `out`.
+
+    Only the GOPs around the cut points are decoded: the ones in between are
+    copied, the partial ones at each edge re-encoded with the source codec, and
+    the pieces joined with the audio, cut per range, in one copy pass. Codecs we
+    can't re-create fall back to a copy cut, which snaps to keyframes.
+    Subtitles are left out of a smart cut, their events can't be cut at the
+    frames the video is. Returns the seconds that were re-encoded."""
+    for start, end in cuts:
+        if end <= start:
+            raise ValueError("The end of the trim comes before its start")
+    info = await probe(path)
+    encoder = ENCODERS.get(info["video_codec"])
+    folder = f"{os.path.splitext(out)[0]}_pieces_{time.time_ns()}"
+    os.makedirs(folder)
+    try:
+        if encoder is None:
+            audio = _listing(folder, "cuts.txt", _cuts(path, cuts))
+            await run(FFMPEG + ["-f", "concat", "-safe", "0", "-i", audio,
+                                "-map", "0", "-c", "copy", "-avoid_negative_ts", "make_zero", out, "-y"])
+            return 0.0
+        keyframes = await probe.keyframes_between(path, cuts)
+        pieces = [piece for start, end in cuts for piece in plan(keyframes, start, end)]
+        names = []
+        for i, (a, b, copy) in enumerate(pieces):
+            name = f"piece_{i}.ts"
+            names.append(f"file '{name}'")
+            if copy:
+                # -ss before -i seeks by index, a copy lands on the keyframe at or before
+                # it, so aim a hair past the keyframe to not fall back a whole GOP, and
+                # stop a hair before the keyframe at `b`, the next piece starts with it
+                cmd = FFMPEG + ["-ss", f"{a + 0.001:.6f}", "-i", path, "-t", f"{b - a - 0.002:.6f}",
+                                "-map", "0:v:0", "-an", "-sn", "-c:v", "copy", "-bsf:v", encoder[-1]]
+            else:
+                cmd = FFMPEG + ["-ss", f"{a:.6f}", "-i", path, "-t", f"{b - a:.6f}",
+                                "-map", "0:v:0", "-an", "-sn"] + encoder + ["-pix_fmt", info["pix_fmt"] or "yuv420p"]
+            await run(cmd + [os.path.join(folder, name), "-y"])
+        video = _listing(folder, "list.txt", names)
+        cmd = FFMPEG + ["-f", "concat", "-safe", "0", "-i", video]
+        maps = ["-map", "0:v"]
+        if info["audio_codec"]:
+            tracks = []
+            for i, (start, end) in enumerate(cuts):
+                # the seek lands on a video keyframe before `start`, -copypriorss 0 drops
+                # the audio packets before it, which are all keyframes, so the range
+                # starts within a packet of `start` and doesn't overlap the one before
+                name = f"audio_{i}.mka"
+                tracks.append(f"file '{name}'")
+                await run(FFMPEG + ["-ss", f"{start:.6f}", "-i", path, "-t", f"{end - start:.6f}",
+                                    "-map", "0:a", "-c:a", "copy", "-copypriorss", "0",
+                                    os.path.join(folder, name), "-y"])
+            audio = _listing(folder, "audio.txt", tracks)
+            cmd += ["-f", "concat", "-safe", "0", "-i", audio]
+            maps += ["-map", "1:a"]
+        await run(cmd + maps + ["-c", "copy", out, "-y"])
+        return sum(b - a for a, b, copy in pieces if not copy)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
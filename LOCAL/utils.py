@@ -12,13 +12,11 @@
 #
 #  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
 
+import re
 import time
 import math
-import re
 import asyncio
-import subprocess
-from ethon.pyfunc import total_frames as tf
-from telethon import events
+from collections import deque
 
 def time_formatter(milliseconds: int) -> str:
     """Inputs time in milliseconds, to get beautified time,
@@ -49,63 +47,187 @@ def humanbytes(size):
         size /= 1024
     return f"{size:.2f} {unit}"
    
-async def ffmpeg_progress(cmd, file, progress, now, event, ps_name):
-    total_frames = tf(file)
-    with open(progress, "w") as fk:
-        pass
-    proce = await asyncio.create_subprocess_shell(cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    while proce.returncode != 0:
-        await asyncio.sleep(3)
-        with open(progress, "r+") as fil:
-            text = fil.read()
-            frames = re.findall("frame=(\\d+)", text)
-            size = re.findall("total_size=(\\d+)", text)
-            speed = 0
-            if len(frames):
-                elapse = int(frames[-1])
-            if len(size):
-                size = int(size[-1])
-                per = elapse * 100 / int(total_frames)
-                time_diff = time.time() - int(now)
-                speed = round(elapse / time_diff, 2)
-            if int(speed) != 0:
-                some_eta = ((int(total_frames) - elapse) / speed) * 1000
-                progress_str = "**[{0}{1}]** `| {2}%\n\n`".format(
-                    "".join("█" for i in range(math.floor(per / 5))),
-                    "".join("" for i in range(20 - math.floor(per / 5))),
-                    round(per, 2),
-                )
-                e_size = humanbytes(size) + " of ~" + humanbytes((size / per) * 100)
-                eta = time_formatter(some_eta)
-                await event.edit(f'{ps_name}\n\n{progress_str}' + f'GROSS: {e_size}\n\nETA: {eta}')
-                            
-async def ffmpeg_exec_progress(cmd, file, progress, now, event, ps_name):
-    total_frames = tf(file)
-    with open(progress, "w") as fk:
-        pass
-    proce = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    while proce.returncode != 0:
-        await asyncio.sleep(3)
-        with open(progress, "r+") as fil:
-            text = fil.read()
-            frames = re.findall("frame=(\\d+)", text)
-            size = re.findall("total_size=(\\d+)", text)
-            speed = 0
-            if len(frames):
-                elapse = int(frames[-1])
-            if len(size):
-                size = int(size[-1])
-                per = elapse * 100 / int(total_frames)
-                time_diff = time.time() - int(now)
-                speed = round(elapse / time_diff, 2)
-            if int(speed) != 0:
-                some_eta = ((int(total_frames) - elapse) / speed) * 1000
-                progress_str = "**[{0}{1}]** `| {2}%\n\n`".format(
-                    "".join("█" for i in range(math.floor(per / 5))),
-                    "".join("" for i in range(20 - math.floor(per / 5))),
-                    round(per, 2),
-                )
-                e_size = humanbytes(size) + " of ~" + humanbytes((size / per) * 100)
-                eta = time_formatter(some_eta)
-                await event.edit(f'{ps_name}\n\n{progress_str}' + f'GROSS: {e_size}\n\nETA: {eta}')
-                            
+class FFmpegProgress:
+    """State of a running ffmpeg, fed line by line from `-progress pipe:1`.
+
+    Percent and ETA come from `out_time_us` against the probed duration,
+    the speed (media seconds per second) is smoothed with an EWMA."""
+
+    def __init__(self, duration=None, alpha=0.3):
+        self.duration = float(duration or 0)
+        self.alpha = alpha
+        self.values = {}
+        self.out_time = 0.0
+        self.size = 0
+        self.speed = None
+        self.started = time.time()
+        self._last = None
+
+    def feed(self, line):
+        """Returns True when a complete progress block has been read."""
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return False
+        if key != "progress":
+            self.values[key] = value
+            return False
+        self._update()
+        return True
+
+    def _update(self):
+        # out_time_ms is in microseconds as well, older builds only print that one
+        us = self.values.get("out_time_us") or self.values.get("out_time_ms")
+        try:
+            out_time = max(int(us) / 1000000, 0)
+        except (TypeError, ValueError):
+            return
+        try:
+            size = int(self.values.get("total_size", self.size))
+        except ValueError:
+            size = self.size
+        self.advance(out_time, size)
+
+    def advance(self, out_time, size=None):
+        """Records that `out_time` seconds of media are done, for progress
+        put together from several ffmpeg runs."""
+        if size is not None:
+            self.size = size
+        now = time.time()
+        if self._last is not None:
+            wall = now - self._last[0]
+            if wall > 0:
+                speed = (out_time - self._last[1]) / wall
+                if self.speed is None:
+                    self.speed = speed
+                else:
+                    self.speed = self.alpha * speed + (1 - self.alpha) * self.speed
+        self._last = (now, out_time)
+        self.out_time = out_time
+
+    @property
+    def percent(self):
+        if not self.duration:
+            return 0
+        return min(self.out_time * 100 / self.duration, 100)
+
+    @property
+    def eta(self):
+        """Seconds left, None until there is a speed to go by."""
+        if not self.duration or not self.speed or self.speed <= 0:
+            return None
+        return max(self.duration - self.out_time, 0) / self.speed
+
+# `-progress` lines, told apart from errors when both come on stderr
+PROGRESS_LINE = re.compile(r"^[a-z0-9_]+=\S*\s*$")
+
+async def run_ffmpeg(cmd, duration=None, callback=None, interval=3, stdin=None, stdout=None):
+    """Runs the ffmpeg `cmd` list, reading its progress from a pipe instead of a file.
+    `callback(progress)` is awaited at most every `interval` seconds, `stdin` is
+    an async iterable of bytes written to ffmpeg for an input of `pipe:0`, and
+    `stdout(chunk)` is awaited with the data of an output of `pipe:1`, the
+    progress then comes on stderr.
+    Raises when ffmpeg fails, returns the final FFmpegProgress."""
+    channel = "pipe:1" if stdout is None else "pipe:2"
+    cmd = [cmd[0], "-progress", channel, "-nostats"] + list(cmd[1:])
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    progress = FFmpegProgress(duration)
+    errors = deque(maxlen=10)
+    last = 0
+
+    async def report(line):
+        nonlocal last
+        if progress.feed(line) and callback is not None:
+            if time.time() - last >= interval:
+                last = time.time()
+                await callback(progress)
+
+    async def read_stderr():
+        async for line in process.stderr:
+            line = line.decode(errors="ignore")
+            if stdout is not None and PROGRESS_LINE.match(line):
+                await report(line)
+            else:
+                errors.append(line.strip())
+
+    async def read_stdout():
+        if stdout is None:
+            async for line in process.stdout:
+                await report(line.decode(errors="ignore"))
+            return
+        while True:
+            chunk = await process.stdout.read(256 * 1024)
+            if not chunk:
+                return
+            await stdout(chunk)
+
+    async def write_stdin():
+        try:
+            async for chunk in stdin:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg stopped reading, its exit code tells why
+            return
+        except Exception:
+            process.kill()
+            raise
+        finally:
+            if not process.stdin.is_closing():
+                process.stdin.close()
+
+    reader = asyncio.ensure_future(read_stderr())
+    writer = asyncio.ensure_future(write_stdin()) if stdin is not None else None
+    try:
+        await read_stdout()
+    except Exception:
+        process.kill()
+        raise
+    finally:
+        await process.wait()
+        await reader
+    if writer is not None:
+        if not writer.done():
+            writer.cancel()
+        try:
+            await writer
+        except asyncio.CancelledError:
+            pass
+    if process.returncode != 0:
+        raise Exception(f"ffmpeg exited with code {process.returncode}: " + " | ".join(errors))
+    return progress
+
+def progress_text(progress, ps_name):
+    per = progress.percent
+    progress_str = "**[{0}{1}]** `| {2}%\n\n`".format(
+        "".join("█" for i in range(math.floor(per / 5))),
+        "".join("" for i in range(20 - math.floor(per / 5))),
+        round(per, 2),
+    )
+    text = f'{ps_name}\n\n{progress_str}'
+    if progress.size and per:
+        text += 'GROSS: ' + humanbytes(progress.size) + " of ~" + humanbytes((progress.size / per) * 100) + '\n\n'
+    if progress.speed:
+        text += f'SPEED: {round(progress.speed, 2)}x\n\n'
+    eta = progress.eta
+    if eta is not None:
+        text += 'ETA: ' + (time_formatter(eta * 1000) or "0s")
+    return text
+
+def show_progress(event, ps_name):
+    """Callback for run_ffmpeg that keeps `event` edited with the progress."""
+    async def show(progress):
+        try:
+            await event.edit(progress_text(progress, ps_name))
+        except Exception as e:
+            print(e)
+    return show
+
+async def ffmpeg_progress(cmd, duration, event, ps_name, stdin=None, stdout=None, run=None):
+    """Runs ffmpeg, through `run` in place of run_ffmpeg if given, and keeps
+    `event` edited with its progress."""
+    return await (run or run_ffmpeg)(cmd, duration, show_progress(event, ps_name), stdin=stdin, stdout=stdout)
@@ -0,0 +1,85 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+"""libvpx-vp9 options sized to the picture and the machine.
+
+    python3 -m LOCAL.vp9 --seconds 10
+
+benchmarks the encode speed of each tile layout on generated test video."""
+
+import os
+import time
+import asyncio
+import argparse
+
+from LOCAL.utils import run_ffmpeg
+
+# VP9 tiles are at least 256 pixels wide and at most 64 to a frame
+MIN_TILE = 256
+MAX_TILE_COLUMNS = 6
+
+def tile_columns(width):
+    """log2 of the most tile columns a frame `width` pixels wide can have."""
+    columns = 0
+    while columns < MAX_TILE_COLUMNS and width >= MIN_TILE << (columns + 1):
+        columns += 1
+    return columns
+
+def vp9_args(width, speed=5, cores=None, crf=32):
+    """Constant quality libvpx-vp9 options for a video `width` pixels wide.
+
+    Every tile column is encoded by its own thread and row-mt splits them
+    further by rows, so the thread count follows the tiles up to the cores
+    there are. `speed` is -cpu-used from 0 (slowest) to 8, the ones above 5
+    need the realtime deadline."""
+    cores = cores or os.cpu_count() or 1
+    speed = min(max(int(speed), 0), 8)
+    columns = tile_columns(width)
+    # row-mt keeps about two threads busy per tile column
+    threads = max(1, min(cores, 2 << columns))
+    return ["-c:v", "libvpx-vp9", "-crf", str(crf), "-b:v", "0",
+            "-deadline", "realtime" if speed > 5 else "good", "-cpu-used", str(speed),
+            "-tile-columns", str(columns), "-row-mt", "1", "-threads", str(threads),
+            "-frame-parallel", "0", "-pix_fmt", "yuv420p"]
+
+async def bench(seconds, speed, sizes):
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores, cpu-used {speed}, {seconds}s of testsrc2 at 30 fps")
+    for size in sizes:
+        width = int(size.split("x")[0])
+        best = tile_columns(width)
+        for columns in range(best + 1):
+            for row_mt in ("0", "1"):
+                args = vp9_args(width, speed, cores)
+                args[args.index("-tile-columns") + 1] = str(columns)
+                args[args.index("-row-mt") + 1] = row_mt
+                if row_mt == "0":
+                    args[args.index("-threads") + 1] = str(min(cores, 1 << columns))
+                started = time.time()
+                progress = await run_ffmpeg(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+                                             "-i", f"testsrc2=size={size}:rate=30:duration={seconds}"]
+                                            + args + ["-an", "-f", "null", "-"], seconds)
+                took = time.time() - started
+                frames = int(progress.values.get("frame", seconds * 30))
+                threads = args[args.index("-threads") + 1]
+                mark = " <- picked" if columns == best and row_mt == "1" else ""
+                print(f"{size:>9} tiles 2^{columns} row-mt {row_mt} threads {threads:>2}: {frames / took:6.1f} fps{mark}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VP9 tile layout benchmark")
+    parser.add_argument("--seconds", type=int, default=10, help="length of the test video")
+    parser.add_argument("--speed", type=int, default=5, help="-cpu-used")
+    parser.add_argument("--sizes", nargs="+", default=["854x480", "1280x720", "1920x1080"])
+    args = parser.parse_args()
+    asyncio.run(bench(args.seconds, args.speed, args.sizes))
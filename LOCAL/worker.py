@@ -0,0 +1,81 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+"""Encode worker, runs the ffmpeg jobs the bot puts on the broker.
+
+    python3 -m LOCAL.worker --broker sqlite:////shared/jobs.db --root /shared --jobs 2
+
+The job paths are relative to the bot's working directory, `--root` is where
+that directory is mounted on this machine. Workers keep no state, start as
+many as the machines allow."""
+
+import os
+import time
+import socket
+import asyncio
+import argparse
+
+from LOCAL.broker import connect
+from LOCAL.utils import run_ffmpeg
+
+class Cancelled(Exception):
+    pass
+
+# seconds between clear-outs of jobs that ended long ago
+PURGE_EVERY = 3600
+
+async def work(broker, name, poll=1):
+    purged = 0
+    while True:
+        if time.time() - purged >= PURGE_EVERY:
+            purged = time.time()
+            await broker.purge()
+        job = await broker.claim(name)
+        if job is None:
+            await asyncio.sleep(poll)
+            continue
+        id, payload = job
+        started = time.time()
+
+        async def report(progress):
+            if not await broker.report(id, name, {"out_time": progress.out_time, "size": progress.size}):
+                # cancelled, or stale and claimed by another worker that writes
+                # the same output; raising here kills ffmpeg
+                raise Cancelled(f"job {id} was cancelled or taken over")
+
+        try:
+            progress = await run_ffmpeg(payload["cmd"], payload.get("duration"), report, payload.get("interval", 3))
+            await report(progress)
+            await broker.finish(id, name, {"worker": name, "took": time.time() - started, "size": progress.size})
+            print(f"{name}: job {id} done in {time.time() - started:.1f}s")
+        except Cancelled as e:
+            print(f"{name}: {e}")
+        except Exception as e:
+            print(f"{name}: job {id} failed: {e}")
+            await broker.fail(id, name, str(e))
+
+async def main(url, root, jobs, poll):
+    os.chdir(root)
+    broker = connect(url)
+    host = socket.gethostname()
+    await asyncio.gather(*(work(broker, f"{host}-{os.getpid()}-{i}", poll) for i in range(jobs)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VIDEOconvertor encode worker")
+    parser.add_argument("--broker", default=os.environ.get("ENCODE_BROKER", "sqlite:///jobs.db"))
+    parser.add_argument("--root", default=".", help="the bot's working directory as mounted here")
+    parser.add_argument("--jobs", type=int, default=1, help="jobs run at the same time")
+    parser.add_argument("--poll", type=float, default=1, help="seconds between looks at the queue")
+    args = parser.parse_args()
+    asyncio.run(main(args.broker, args.root, args.jobs, args.poll))
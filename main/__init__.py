@@ -1,5 +1,5 @@
 from telethon import TelegramClient
-from decouple import config
+from decouple import config, Csv
 import logging
 import time
 
@@ -12,4 +12,45 @@ API_HASH = config("API_HASH", default=None)
 BOT_TOKEN = config("BOT_TOKEN", default=None)
 BOT_UN = config("BOT_UN", default=None)
 
+# job scheduler
+WORKERS = config("WORKERS", default=0, cast=int)
+TRANSFER_WORKERS = config("TRANSFER_WORKERS", default=2, cast=int)
+QUEUE_SIZE = config("QUEUE_SIZE", default=20, cast=int)
+USER_JOBS = config("USER_JOBS", default=5, cast=int)
+ADMINS = config("ADMINS", default="", cast=Csv(int))
+
+# results already sent, keyed by input document and operation
+RESULT_CACHE = config("RESULT_CACHE", default="results.db")
+RESULT_CACHE_SIZE = config("RESULT_CACHE_SIZE", default=2000, cast=int)
+RESULT_CACHE_DAYS = config("RESULT_CACHE_DAYS", default=7, cast=float)
+
+# status message edits
+EDIT_RATE = config("EDIT_RATE", default=2, cast=float)
+EDIT_INTERVAL = config("EDIT_INTERVAL", default=3, cast=float)
+
+# downloaded inputs shared between operations on the same file
+INPUT_CACHE_TTL = config("INPUT_CACHE_TTL", default=600, cast=int)
+INPUT_CACHE_MB = config("INPUT_CACHE_MB", default=4096, cast=int)
+
+# download videos while the user is still choosing what to do with them
+PREFETCH = config("PREFETCH", default=False, cast=bool)
+PREFETCH_MB = config("PREFETCH_MB", default=2048, cast=int)
+PREFETCH_JOBS = config("PREFETCH_JOBS", default=1, cast=int)
+PREFETCH_WAIT = config("PREFETCH_WAIT", default=120, cast=int)
+
+# feed videos to ffmpeg while they download when the container allows it
+STREAM_INPUT = config("STREAM_INPUT", default=False, cast=bool)
+
+# upload encodes as fragmented MP4 while ffmpeg still writes them
+LIVE_UPLOAD = config("LIVE_UPLOAD", default=False, cast=bool)
+
+# ffmpeg processes encoding segments of one video side by side, 0 adds one per idle encode slot, 1 turns it off
+SEGMENT_WORKERS = config("SEGMENT_WORKERS", default=0, cast=int)
+
+# libvpx-vp9 -cpu-used for WebM output, 0 is the slowest and smallest, 6 and up encode in realtime mode
+VP9_SPEED = config("VP9_SPEED", default=5, cast=int)
+
+# queue shared with encode workers on other machines, empty encodes here
+ENCODE_BROKER = config("ENCODE_BROKER", default="")
+
 Drone = TelegramClient('bot', API_ID, API_HASH).start(bot_token=BOT_TOKEN) 
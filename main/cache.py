@@ -0,0 +1,153 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import time, sqlite3, asyncio, threading
+
+from telethon.tl.types import InputDocument
+
+from . import RESULT_CACHE, RESULT_CACHE_SIZE, RESULT_CACHE_DAYS
+
+def document_id(msg):
+    document = getattr(msg.media, "document", None)
+    return document.id if document is not None else None
+
+def own_caption(msg, sent):
+    """Caption of `sent` without the caption of the input `msg` some plugins
+    put in front of theirs, so another user's caption is never handed out."""
+    text = getattr(sent, "text", None) or ""
+    for original in (msg.text, msg.message):
+        if original and text.startswith(original):
+            return text[len(original):].strip()
+    return text
+
+class ResultCache:
+    """Remembers which Telegram document we sent for (input document id, operation),
+    so the same forwarded video can be answered again without any work."""
+
+    def __init__(self, path, size=2000, days=7):
+        self.size = size
+        self.age = days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS results (
+            doc_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            access_hash INTEGER NOT NULL,
+            file_reference BLOB NOT NULL,
+            caption TEXT,
+            created REAL NOT NULL,
+            used REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (doc_id, op))""")
+        self.db.commit()
+
+    async def _call(self, fn, *args):
+        # sqlite blocks on disk and on other writers, keep it off the event loop
+        def locked():
+            with self.lock:
+                return fn(*args)
+        return await asyncio.to_thread(locked)
+
+    def _rows(self, doc_id, op):
+        # a result of several messages is kept as `op #i/n`, one row each
+        return self.db.execute("SELECT op, id, access_hash, file_reference, caption, created FROM results "
+                               "WHERE doc_id = ? AND (op = ? OR substr(op, 1, ?) = ?)",
+                               (doc_id, op, len(op) + 2, op + " #")).fetchall()
+
+    def _get(self, doc_id, op):
+        rows = self._rows(doc_id, op)
+        if len(rows) > 1 or (rows and rows[0][0] != op):
+            rows = sorted((row for row in rows if row[0] != op), key=lambda row: int(row[0].rsplit("#", 1)[1].split("/")[0]))
+            # eviction may have taken some of the parts
+            if len(rows) != int(rows[0][0].rsplit("/", 1)[1]):
+                rows = []
+        if not rows or any(row[5] < time.time() - self.age for row in rows):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.executemany("UPDATE results SET used = ?, hits = hits + 1 WHERE doc_id = ? AND op = ?",
+                            [(time.time(), doc_id, row[0]) for row in rows])
+        self.db.commit()
+        return [(InputDocument(id=row[1], access_hash=row[2], file_reference=row[3]), row[4]) for row in rows]
+
+    async def get(self, msg, op):
+        """[(document, caption)] of the cached result of `op` on `msg`, or None."""
+        doc_id = document_id(msg)
+        if doc_id is None:
+            return None
+        return await self._call(self._get, doc_id, op)
+
+    def _forget(self, doc_id, op):
+        self.db.executemany("DELETE FROM results WHERE doc_id = ? AND op = ?",
+                            [(doc_id, row[0]) for row in self._rows(doc_id, op)])
+        self.db.commit()
+
+    async def forget(self, msg, op):
+        await self._call(self._forget, document_id(msg), op)
+
+    def _store(self, doc_id, op, rows):
+        self._forget(doc_id, op)
+        self.db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)", rows)
+        self.evict()
+
+    async def store(self, msg, op, sent):
+        """Records the message `sent`, or the list of messages, in answer to
+        `op` on `msg`, with only the part of their captions the bot wrote."""
+        doc_id = document_id(msg)
+        messages = sent if isinstance(sent, list) else [sent]
+        documents = [getattr(getattr(message, "media", None), "document", None) for message in messages]
+        if doc_id is None or not documents or None in documents:
+            return
+        now = time.time()
+        rows = [(doc_id, op if len(messages) == 1 else f"{op} #{i}/{len(messages)}",
+                 document.id, document.access_hash, document.file_reference, own_caption(msg, message), now, now)
+                for i, (message, document) in enumerate(zip(messages, documents))]
+        await self._call(self._store, doc_id, op, rows)
+
+    def evict(self):
+        self.db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.age,))
+        self.db.execute("DELETE FROM results WHERE rowid NOT IN "
+                        "(SELECT rowid FROM results ORDER BY used DESC LIMIT ?)", (self.size,))
+        self.db.commit()
+
+    async def send(self, event, msg, op):
+        """Re-sends a cached result for `op` on `msg`, returns the sent message,
+        the list of them for a result of several, or None."""
+        cached = await self.get(msg, op)
+        if cached is None:
+            return None
+        try:
+            sent = [await event.client.send_file(event.chat_id, document, caption=caption, reply_to=msg.id)
+                    for document, caption in cached]
+            return sent if len(sent) > 1 else sent[0]
+        except Exception as e:
+            # file references expire, do the work again and cache the new one
+            print(f"Cached result for {op} unusable: {e}")
+            await self.forget(msg, op)
+            return None
+
+    async def stats(self):
+        entries = (await self._call(lambda: self.db.execute("SELECT COUNT(*) FROM results").fetchone()))[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+        }
+
+results = ResultCache(RESULT_CACHE, RESULT_CACHE_SIZE, RESULT_CACHE_DAYS)
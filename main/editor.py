@@ -0,0 +1,154 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import time, asyncio
+
+from collections import OrderedDict
+from contextvars import ContextVar
+from telethon.errors.rpcerrorlist import FloodWaitError, MessageNotModifiedError
+
+from . import EDIT_RATE, EDIT_INTERVAL
+
+# status messages of other chats that should see the same edits, set per job
+mirrors = ContextVar("mirrors", default=())
+
+def _key(message):
+    # callback query events carry the query id in `id`
+    return (message.chat_id, getattr(message, "message_id", None) or message.id)
+
+class EditScheduler:
+    """Sends every status edit from one task.
+
+    Pending edits are kept per message and only the latest text is sent,
+    edits are spread out to at most `rate` per second overall and one per
+    `interval` seconds per chat, and the whole queue pauses when Telegram
+    answers with a FloodWait, so progress messages never hold up uploads."""
+
+    def __init__(self, rate=2, interval=3):
+        self.base = 1 / rate
+        self.delay = self.base
+        self.interval = interval
+        self.sent = 0
+        self.skipped = 0
+        self.floods = 0
+        self._pending = OrderedDict()
+        self._last = OrderedDict()
+        self._chats = {}
+        self._paused = 0
+        self._wake = None
+        self._task = None
+
+    def request(self, message, text, **kwargs):
+        """Schedules `message.edit(text, **kwargs)`, replacing any older pending text."""
+        if isinstance(message, LiveMessage):
+            message = message._message
+        key = _key(message)
+        if key not in self._pending and self._last.get(key) == text:
+            self.skipped += 1
+            return
+        if key in self._pending:
+            self.skipped += 1
+        self._pending[key] = (message, text, kwargs)
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_event_loop().create_task(self._run())
+        self._wake.set()
+
+    def forget(self, message):
+        if isinstance(message, LiveMessage):
+            message = message._message
+        key = _key(message)
+        self._pending.pop(key, None)
+        self._last.pop(key, None)
+
+    def _next(self):
+        """Oldest pending edit whose chat may be edited again, or the seconds to wait."""
+        now = time.time()
+        wait = None
+        for key, (message, text, kwargs) in self._pending.items():
+            ready = self._chats.get(key[0], 0) + self.interval
+            if ready <= now:
+                del self._pending[key]
+                return key, message, text, kwargs
+            wait = ready - now if wait is None else min(wait, ready - now)
+        return wait
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            if self._paused > time.time():
+                await asyncio.sleep(self._paused - time.time())
+                continue
+            item = self._next()
+            if not isinstance(item, tuple):
+                await asyncio.sleep(item)
+                continue
+            key, message, text, kwargs = item
+            if self._last.get(key) == text:
+                continue
+            self._chats[key[0]] = time.time()
+            try:
+                await message.edit(text, **kwargs)
+                self._remember(key, text)
+                self.sent += 1
+                self.delay = max(self.base, self.delay * 0.9)
+            except MessageNotModifiedError:
+                self._remember(key, text)
+            except FloodWaitError as e:
+                self.floods += 1
+                self._paused = time.time() + e.seconds
+                self.delay = min(self.delay * 2, 30)
+                # keep the text unless a newer one came in meanwhile
+                if key not in self._pending:
+                    self._pending[key] = (message, text, kwargs)
+                    self._pending.move_to_end(key, last=False)
+                print(f"Edits paused for {e.seconds}s after a FloodWait.")
+            except Exception as e:
+                print(f"Edit failed: {e}")
+            await asyncio.sleep(self.delay)
+
+    def _remember(self, key, text):
+        self._last[key] = text
+        self._last.move_to_end(key)
+        while len(self._last) > 1000:
+            self._last.popitem(last=False)
+
+    def live(self, message):
+        return LiveMessage(self, message)
+
+class LiveMessage:
+    """A message whose `edit` goes through the EditScheduler instead of
+    calling Telegram directly, everything else is passed through."""
+
+    def __init__(self, editor, message):
+        self._editor = editor
+        self._message = message
+        self._mirrors = mirrors.get()
+
+    async def edit(self, text, **kwargs):
+        self._editor.request(self._message, text, **kwargs)
+        for mirror in self._mirrors:
+            self._editor.request(mirror, text, **kwargs)
+
+    async def delete(self, *args, **kwargs):
+        self._editor.forget(self._message)
+        return await self._message.delete(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._message, name)
+
+editor = EditScheduler(EDIT_RATE, EDIT_INTERVAL)
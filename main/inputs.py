@@ -0,0 +1,368 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import os, time, shutil, asyncio
+
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from ethon.telefunc import fast_download
+
+from . import INPUT_CACHE_TTL, INPUT_CACHE_MB, PREFETCH, PREFETCH_MB, PREFETCH_JOBS, PREFETCH_WAIT, STREAM_INPUT
+from main.scheduler import scheduler
+
+from LOCAL.probe import probe, stream_header
+
+# paths acquired inside the running `inputs.session()`
+held = ContextVar("held", default=None)
+
+def link(path, out):
+    """Gives `out` the content of `path` without touching `path`."""
+    if os.path.exists(out):
+        os.remove(out)
+    try:
+        os.link(path, out)
+    except OSError:
+        shutil.copyfile(path, out)
+
+class Entry:
+    def __init__(self, key, path, size):
+        self.key = key
+        self.path = path
+        self.size = size or 0
+        self.refs = 0
+        self.used = time.time()
+        self.task = None
+        # set while the file is prefetched and no operation asked for it yet
+        self.relay = None
+        # bytes on disk so far and when they changed, for streamed downloads
+        self.received = 0
+        self.grown = None
+        self.began = None
+        self.finished = None
+
+class Relay:
+    """Progress target of a prefetch, edits are dropped until an
+    operation attaches its status message."""
+
+    def __init__(self):
+        self.target = None
+        # an operation was chosen but waits in the queue
+        self.claimed = False
+
+    async def edit(self, text, **kwargs):
+        if self.target is not None:
+            await self.target.edit(text, **kwargs)
+
+class Stream:
+    """An input that is still downloading, read front to back.
+
+    Iterating it yields the file in order as the chunks arrive, which is
+    what ffmpeg needs for an input of `pipe:0`."""
+
+    def __init__(self, entry, header):
+        self.entry = entry
+        self.path = entry.path
+        self.header = header
+
+    async def _wait(self, received):
+        entry = self.entry
+        async with entry.grown:
+            await entry.grown.wait_for(lambda: entry.received >= received or entry.task.done())
+        if entry.task.done():
+            entry.task.result()
+
+    async def probe(self):
+        """Probes the part already on disk once it holds the container header."""
+        await self._wait(min(self.header, self.entry.size or self.header))
+        return await probe(self.path)
+
+    async def __aiter__(self):
+        await self._wait(1)
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if chunk:
+                    yield chunk
+                elif self.entry.task.done():
+                    self.entry.task.result()
+                    chunk = f.read()
+                    if not chunk:
+                        return
+                    yield chunk
+                else:
+                    await self._wait(f.tell() + 1)
+
+    def saved(self, started, finished):
+        """Seconds the download overlapped with work done between `started` and `finished`."""
+        end = min(self.entry.finished or finished, finished)
+        return max(end - max(self.entry.began or started, started), 0)
+
+class InputCache:
+    """Downloaded inputs keyed by Telegram document id.
+
+    A video is downloaded once and shared by every operation run on it
+    (SSHOTS, then TRIM, then ENCODE...). Files nobody is using are removed
+    after `ttl` seconds, or earlier, least recently used first, when the
+    cache would grow past `budget` bytes."""
+
+    def __init__(self, folder="inputs", ttl=600, budget=4096 * 1024 * 1024,
+                 prefetch_budget=0, prefetch_jobs=1, prefetch_wait=120, streaming=False):
+        self.folder = folder
+        self.ttl = ttl
+        self.budget = budget
+        self.prefetch_budget = prefetch_budget
+        self.prefetch_jobs = prefetch_jobs
+        self.prefetch_wait = prefetch_wait
+        self.streaming = streaming
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.prefetch_used = 0
+        self.prefetch_wasted = 0
+        self.streamed = 0
+        self._entries = OrderedDict()
+        self._paths = {}
+        self._sweeper = None
+
+    def _key(self, msg):
+        media = getattr(msg.media, "document", None) or getattr(msg.media, "photo", None)
+        if media is not None:
+            return str(media.id)
+        return f"{msg.chat_id}_{msg.id}"
+
+    def _usable(self, entry):
+        if not entry.task.done():
+            return True
+        return (not entry.task.cancelled() and entry.task.exception() is None
+                and os.path.exists(entry.path))
+
+    @asynccontextmanager
+    async def session(self):
+        """Releases every input acquired inside the block when it ends."""
+        token = held.set([])
+        try:
+            yield
+        finally:
+            for path in held.get():
+                self.release(path)
+            held.reset(token)
+
+    async def acquire(self, msg, edit):
+        """Path of the downloaded input of `msg`, downloading it if needed.
+        Outside a `session()` every acquire must be matched by a `release(path)`."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_event_loop().create_task(self._sweep())
+        key = self._key(msg)
+        entry = self._entries.get(key)
+        if entry is not None and not self._usable(entry):
+            self._drop(entry)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            entry = self._start(key, msg, edit)
+        elif entry.relay is not None:
+            # the prefetch becomes a real download, its progress now goes to `edit`
+            self.hits += 1
+            self.prefetch_used += 1
+            entry.relay.target = edit
+            entry.relay = None
+        else:
+            self.hits += 1
+            if not entry.task.done():
+                await edit.edit("Waiting for the download of this file that is already running.")
+        entry.refs += 1
+        try:
+            await asyncio.shield(entry.task)
+        except BaseException:
+            entry.refs -= 1
+            if entry.task.done() and not self._usable(entry):
+                self._drop(entry)
+            raise
+        entry.used = time.time()
+        self._entries.move_to_end(key)
+        if held.get() is not None:
+            held.get().append(entry.path)
+        return entry.path
+
+    async def stream(self, msg, edit):
+        """Like `acquire`, but returns `(path, stream)` where `stream` is a Stream
+        when the file can be read while it downloads, and None when `path` is
+        complete. Files already cached or downloading, containers that need
+        seeking and everything when disabled come back complete."""
+        if not self.streaming or self._key(msg) in self._entries:
+            return await self.acquire(msg, edit), None
+        file = getattr(msg.media, "document", msg.media)
+        head = b""
+        async for chunk in msg.client.iter_download(file, limit=1):
+            head = chunk
+        header = stream_header(head)
+        key = self._key(msg)
+        if header is None or key in self._entries:
+            return await self.acquire(msg, edit), None
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_event_loop().create_task(self._sweep())
+        self.misses += 1
+        self.streamed += 1
+        os.makedirs(self.folder, exist_ok=True)
+        ext = os.path.splitext(msg.file.name or "")[1] or msg.file.ext or ""
+        entry = Entry(key, os.path.join(self.folder, key + ext), msg.file.size)
+        entry.grown = asyncio.Condition()
+        self.evict(entry.size)
+        entry.task = asyncio.ensure_future(self._download_in_order(entry, msg))
+        self._entries[key] = entry
+        self._paths[entry.path] = entry
+        entry.refs += 1
+        if held.get() is not None:
+            held.get().append(entry.path)
+        return entry.path, Stream(entry, header)
+
+    async def _download_in_order(self, entry, msg):
+        # one sequential download instead of fast_download's parallel parts, the
+        # file is complete up to `received` at any time; readers wait on the task
+        # anyway, so it goes to its final path right away
+        file = getattr(msg.media, "document", msg.media)
+        try:
+            async with scheduler.stage("transfer"):
+                entry.began = time.time()
+                with open(entry.path, "wb") as f:
+                    async for chunk in msg.client.iter_download(file):
+                        f.write(chunk)
+                        f.flush()
+                        async with entry.grown:
+                            entry.received += len(chunk)
+                            entry.grown.notify_all()
+                entry.finished = time.time()
+                entry.size = entry.received
+        finally:
+            async with entry.grown:
+                entry.grown.notify_all()
+
+    def release(self, path):
+        entry = self._paths.get(path)
+        if entry is None:
+            return
+        entry.refs = max(entry.refs - 1, 0)
+        entry.used = time.time()
+        self.evict()
+
+    def _start(self, key, msg, edit, relay=None):
+        os.makedirs(self.folder, exist_ok=True)
+        ext = os.path.splitext(msg.file.name or "")[1] or msg.file.ext or ""
+        entry = Entry(key, os.path.join(self.folder, key + ext), msg.file.size)
+        entry.relay = relay
+        self.evict(entry.size)
+        entry.task = asyncio.ensure_future(self._download(entry, msg, relay or edit))
+        self._entries[key] = entry
+        self._paths[entry.path] = entry
+        return entry
+
+    async def _download(self, entry, msg, edit):
+        file = getattr(msg.media, "document", msg.media)
+        part = entry.path + ".part"
+        if entry.relay is None:
+            async with scheduler.stage("transfer"):
+                await fast_download(part, file, msg.client, edit, time.time(), "**DOWNLOADING:**")
+        else:
+            # prefetches are limited by `prefetch_jobs` instead of taking transfer slots from jobs
+            await fast_download(part, file, msg.client, edit, time.time(), "**DOWNLOADING:**")
+        os.rename(part, entry.path)
+        entry.size = os.path.getsize(entry.path)
+
+    def prefetch(self, msg):
+        """Starts downloading and probing `msg` before anyone asked for it.
+        Skipped when disabled, over the prefetch budget or while the transfer
+        stage is saturated, cancelled when no operation attaches within
+        `prefetch_wait` seconds."""
+        if not self.prefetch_budget or not msg.file or self._key(msg) in self._entries:
+            return
+        speculative = [entry for entry in self._entries.values() if entry.relay is not None]
+        if sum(not entry.task.done() for entry in speculative) >= self.prefetch_jobs:
+            return
+        if sum(entry.size for entry in speculative) + (msg.file.size or 0) > self.prefetch_budget:
+            return
+        transfer = scheduler.stages["transfer"]
+        if transfer.busy >= transfer.size:
+            return
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_event_loop().create_task(self._sweep())
+        self.prefetched += 1
+        entry = self._start(self._key(msg), msg, None, Relay())
+        asyncio.ensure_future(self._speculate(entry))
+
+    def claim(self, msg):
+        """Keeps the prefetch of `msg` past `prefetch_wait`, for an operation
+        that was chosen but has not started yet."""
+        entry = self._entries.get(self._key(msg))
+        if entry is not None and entry.relay is not None:
+            entry.relay.claimed = True
+
+    async def _speculate(self, entry):
+        try:
+            await asyncio.wait_for(asyncio.shield(entry.task), self.prefetch_wait)
+            # warms the probe cache for the operation that will use the file
+            await probe(entry.path)
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            print(f"Prefetch of {entry.key} failed: {e}")
+        await asyncio.sleep(max(entry.used + self.prefetch_wait - time.time(), 0))
+        if entry.relay is not None and not entry.relay.claimed and self._entries.get(entry.key) is entry:
+            self.prefetch_wasted += 1
+            self._drop(entry)
+
+    def _drop(self, entry):
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        if self._paths.get(entry.path) is entry:
+            del self._paths[entry.path]
+        if not entry.task.done():
+            entry.task.cancel()
+        for path in (entry.path, entry.path + ".part"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @property
+    def used(self):
+        return sum(entry.size for entry in self._entries.values())
+
+    def evict(self, need=0):
+        """Drops idle inputs past their ttl, then the least recently used
+        ones until `need` more bytes fit in the budget."""
+        now = time.time()
+        for entry in list(self._entries.values()):
+            if entry.refs or not entry.task.done():
+                continue
+            if now - entry.used > self.ttl or self.used + need > self.budget:
+                self._drop(entry)
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(60)
+            self.evict()
+
+    def stats(self):
+        return {
+            "files": len(self._entries),
+            "used": self.used,
+            "hits": self.hits,
+            "misses": self.misses,
+            "prefetched": self.prefetched,
+            "prefetch_used": self.prefetch_used,
+            "prefetch_wasted": self.prefetch_wasted,
+            "streamed": self.streamed,
+        }
+
+inputs = InputCache("inputs", INPUT_CACHE_TTL, INPUT_CACHE_MB * 1024 * 1024,
+                    PREFETCH_MB * 1024 * 1024 if PREFETCH else 0, PREFETCH_JOBS, PREFETCH_WAIT, STREAM_INPUT)
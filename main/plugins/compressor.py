@@ -18,122 +18,162 @@ from datetime import datetime as dt
 from telethon import events
 from telethon.errors.rpcerrorlist import MessageNotModifiedError
 from telethon.tl.types import DocumentAttributeVideo
-from ethon.telefunc import fast_download, fast_upload
-from ethon.pyfunc import video_metadata
+from ethon.telefunc import fast_upload
 
-from .. import Drone, BOT_UN
+from .. import Drone, BOT_UN, SEGMENT_WORKERS, VP9_SPEED
+from main.scheduler import scheduler
+from main.editor import editor
+from main.inputs import inputs
+from main.remote import run
 
 from LOCAL.localisation import SUPPORT_LINK, JPG, JPG2, JPG3
-from LOCAL.utils import ffmpeg_progress
+from LOCAL.utils import ffmpeg_progress, show_progress, time_formatter
+from LOCAL.segments import encode_segments
+from LOCAL.probe import probe
+from LOCAL.streams import codec_args, ENCODERS
+from LOCAL.vp9 import vp9_args
+from LOCAL.av1 import av1_args
+from LOCAL.target import encode_to_size, video_budget, audio_bitrate, MIN_BITRATE
 
-async def compress(event, msg, ffmpeg_cmd=0, ps_name=None):
+async def compress(event, msg, ffmpeg_cmd=0, ps_name=None, target=None):
+    """Encodes with the `ffmpeg_cmd` profile, 7 fits the video into `target` MB."""
     Drone = event.client
     if ps_name is None:
         ps_name = '**COMPRESSING:**'
-    edit = await Drone.send_message(event.chat_id, "Trying to process.", reply_to=msg.id)
-    new_name = "out_" + dt.now().isoformat("_", "seconds")
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process.", reply_to=msg.id))
+    # several jobs can start within the same second, keep names apart
+    stamp = dt.now().isoformat("_", "seconds") + f"_{time.time_ns() % 10**6}"
+    new_name = "out_" + stamp
     mime = msg.file.mime_type
-    if 'mp4' in mime:
-        n = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-        out = new_name + ".mp4"
-    elif msg.video:
-        n = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-        out = new_name + ".mp4"
-    elif 'x-matroska' in mime:
-        n = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
-        out = new_name + ".mp4"            
-    elif 'webm' in mime:
-        n = "media_" + dt.now().isoformat("_", "seconds") + ".webm" 
+    if ffmpeg_cmd == 5:
+        out = new_name + ".webm"
+    elif 'mp4' in mime or msg.video or 'x-matroska' in mime or 'webm' in mime:
         out = new_name + ".mp4"
     else:
-        n = msg.file.name
-        ext = (n.split("."))[1]
-        out = new_name + ext
-    DT = time.time()
+        ext = (msg.file.name.split("."))[1]
+        out = new_name + "." + ext
     try:
-        await fast_download(n, file, Drone, edit, DT, "**DOWNLOADING:**")
+        if ffmpeg_cmd == 7:
+            # sample windows are read from all over the file
+            name, stream = await inputs.acquire(msg, edit), None
+        else:
+            name, stream = await inputs.stream(msg, edit)
     except Exception as e:
-        os.rmdir("encodemedia")
         print(e)
         return await edit.edit(f"An error occured while downloading.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False) 
-    name =  '__' + dt.now().isoformat("_", "seconds") + ".mp4"
-    os.rename(n, name)
     await edit.edit("Extracting metadata...")
-    vid = video_metadata(name)
+    vid = await probe(name) if stream is None else await stream.probe()
     hgt = int(vid['height'])
     wdt = int(vid['width'])
     if ffmpeg_cmd == 2:
         if hgt == 360 or wdt == 640:
             await edit.edit("Fast compress cannot be used for this media, try using HEVC!")
-            os.rmdir("encodemedia")
             return
-    FT = time.time()
-    progress = f"progress-{FT}.txt"
-    cmd = f'ffmpeg -hide_banner -loglevel quiet -progress {progress} -i """{name}""" None """{out}""" -y'
+    video_args = []
     if ffmpeg_cmd == 1:
-        cmd = f'ffmpeg -hide_banner -loglevel quiet -progress {progress} -i """{name}""" -preset ultrafast -vcodec libx265 -crf 28 -acodec copy -c:s copy """{out}""" -y'
+        video_args = ["-preset", "ultrafast", "-vcodec", "libx265", "-crf", "28"]
     elif ffmpeg_cmd == 2:
-        cmd = f'ffmpeg -hide_banner -loglevel quiet -progress {progress} -i """{name}""" -c:v libx265 -crf 22 -preset ultrafast -s 640x360 -c:a copy -c:s copy """{out}""" -y'
+        video_args = ["-c:v", "libx265", "-crf", "22", "-preset", "ultrafast", "-s", "640x360"]
     elif ffmpeg_cmd == 3:
-        cmd = f'ffmpeg -hide_banner -loglevel quiet -progress {progress} -i """{name}""" -preset faster -vcodec libx265 -crf 23 -acodec copy -c:s copy """{out}""" -y'
+        video_args = ["-preset", "faster", "-vcodec", "libx265", "-crf", "23"]
     elif ffmpeg_cmd == 4:
-        cmd = f'ffmpeg -hide_banner -loglevel quiet -progress {progress} -i """{name}""" -preset faster -vcodec libx264 -crf 23 -acodec copy -c:s copy """{out}""" -y'
+        video_args = ["-preset", "faster", "-vcodec", "libx264", "-crf", "23"]
+    elif ffmpeg_cmd == 5:
+        video_args = vp9_args(wdt, VP9_SPEED)
+    elif ffmpeg_cmd == 6:
+        # faster presets for long or big videos and while others wait for an encode slot
+        st = scheduler.stats()
+        video_args = await av1_args(wdt, hgt, vid['duration'] or msg.file.duration or 0, vid['fps'],
+                                    st['queued'] / max(st['stages']['encode']['size'], 1))
+    container = {".mp4": "mp4", ".webm": "webm"}.get(os.path.splitext(out)[1], "mkv")
+    audio_args = codec_args(vid, "audio", container)
+    duration = vid['duration'] or msg.file.duration
+    if ffmpeg_cmd == 7:
+        if not duration:
+            return await edit.edit("The length of this video is unknown, it can't be fitted to a size!")
+        if audio_bitrate(vid, "copy" in audio_args) is None:
+            # a copy of unknown bitrate could take any share of the size
+            audio_args = ENCODERS[container]["audio"]
+        if video_budget(target * 1024 * 1024, duration, audio_bitrate(vid, "copy" in audio_args)) < MIN_BITRATE:
+            return await edit.edit(f"This video can't be made to fit in {target:g} MB, try a bigger size!")
+    other_args = audio_args + codec_args(vid, "subtitle", container)
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", name if stream is None else "pipe:0"] + video_args + other_args + [out, "-y"]
     try:
-        await ffmpeg_progress(cmd, name, progress, FT, edit, ps_name)
+        async with scheduler.stage("encode"):
+            ET = time.time()
+            done = False
+            # libx265 leaves most cores idle on one stream, encode segments side by side
+            # on the cores of our encode slot and of idle ones we hold meanwhile
+            if ffmpeg_cmd in (1, 3) and stream is None:
+                async with scheduler.spare("encode", 0 if SEGMENT_WORKERS else scheduler.stages["encode"].size) as extra:
+                    done = await encode_segments(name, video_args, other_args, [out, "-y"], duration,
+                                                 SEGMENT_WORKERS or 1 + extra,
+                                                 callback=show_progress(edit, ps_name), run=run)
+            if ffmpeg_cmd == 7:
+                await edit.edit(f"Sampling the video to fit it in {target:g} MB...")
+                await encode_to_size(name, out, target * 1024 * 1024, duration, vid, other_args,
+                                     callback=show_progress(edit, ps_name), run=run)
+                done = True
+            if not done:
+                await ffmpeg_progress(cmd, duration, edit, ps_name, stdin=stream, run=run)
+            saved = stream.saved(ET, time.time()) if stream is not None else 0
     except Exception as e:
-        os.rmdir("encodemedia")
         print(e)
         return await edit.edit(f"An error occured while FFMPEG progress.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)   
-    out2 = dt.now().isoformat("_", "seconds") + ".mp4" 
+    # the name shown in Telegram, the file stays at the unique `out` so jobs
+    # on files of the same name don't overwrite each other
     if msg.file.name:
         out2 = msg.file.name
     else:
         out2 = dt.now().isoformat("_", "seconds") + ".mp4" 
-    os.rename(out, out2)
+    if ffmpeg_cmd == 5:
+        out2 = os.path.splitext(out2)[0] + ".webm"
     i_size = os.path.getsize(name)
-    f_size = os.path.getsize(out2)
+    f_size = os.path.getsize(out)
     text = f'COMPRESSED by** : @{BOT_UN}\n\nbefore compressing : `{i_size}`\nafter compressing : `{f_size}`'
     if ps_name != "**ENCODING:**":
         text = f'**COMPRESSED by** : @{BOT_UN}\n\nbefore compressing : `{i_size}`\nafter compressing : `{f_size}`'
+    if ffmpeg_cmd == 7 and f_size > target * 1024 * 1024:
+        text += f'\n\nThis is as small as it got, it misses `{target:g}` MB'
+    if saved >= 1:
+        text += f'\ntime saved by streaming : `{time_formatter(saved * 1000)}`'
+        print(f"Streaming {name} saved {saved:.1f}s")
     UT = time.time()
-    if 'webm' in mime:
+    if 'webm' in mime or ffmpeg_cmd == 5:
         try:
-            uploader = await fast_upload(f'{out2}', f'{out2}', UT, Drone, edit, '**UPLOADING:**')
-            await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG, force_document=True)
+            async with scheduler.stage("transfer"):
+                uploader = await fast_upload(out, out2, UT, Drone, edit, '**UPLOADING:**')
+            sent = await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG, force_document=True)
         except Exception as e:
-            os.rmdir("encodemedia")
             print(e)
             return await edit.edit(f"An error occured while uploading.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)
     elif 'x-matroska' in mime:
         try:
-            uploader = await fast_upload(f'{out2}', f'{out2}', UT, Drone, edit, '**UPLOADING:**')
-            await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG, force_document=True)
+            async with scheduler.stage("transfer"):
+                uploader = await fast_upload(out, out2, UT, Drone, edit, '**UPLOADING:**')
+            sent = await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG, force_document=True)
         except Exception as e:
-            os.rmdir("encodemedia")
             print(e)
             return await edit.edit(f"An error occured while uploading.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)
     else:
-        metadata = video_metadata(out2)
+        metadata = await probe(out)
         width = metadata["width"]
         height = metadata["height"]
-        duration = metadata["duration"]
+        duration = int(metadata["duration"])
         attributes = [DocumentAttributeVideo(duration=duration, w=width, h=height, supports_streaming=True)]
         try:
-            uploader = await fast_upload(f'{out2}', f'{out2}', UT, Drone, edit, '**UPLOADING:**')
-            await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG3, attributes=attributes, force_document=False)
+            async with scheduler.stage("transfer"):
+                uploader = await fast_upload(out, out2, UT, Drone, edit, '**UPLOADING:**')
+            sent = await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG3, attributes=attributes, force_document=False)
         except Exception:
             try:
-                uploader = await fast_upload(f'{out2}', f'{out2}', UT, Drone, edit, '**UPLOADING:**')
-                await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG, force_document=True)
+                async with scheduler.stage("transfer"):
+                    uploader = await fast_upload(out, out2, UT, Drone, edit, '**UPLOADING:**')
+                sent = await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG, force_document=True)
             except Exception as e:
-                os.rmdir("encodemedia")
                 print(e)
                 return await edit.edit(f"An error occured while uploading.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)
     await edit.delete()
-    os.remove(name)
-    os.remove(out2)
+    os.remove(out)
+    return sent
     
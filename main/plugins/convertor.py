@@ -17,373 +17,255 @@ import os, subprocess, time
 from datetime import datetime as dt
 from telethon import events
 from telethon.tl.types import DocumentAttributeVideo
-from ethon.telefunc import fast_download, fast_upload
-from ethon.pyfunc import bash, video_metadata
-from ethon.pyutils import rename
+from ethon.telefunc import fast_upload
 
-from .. import BOT_UN
+from .. import BOT_UN, VP9_SPEED
+from main.scheduler import scheduler
+from main.editor import editor
+from main.inputs import inputs, link
+from main.remote import run
 
 from LOCAL.localisation import SUPPORT_LINK, JPG, JPG2
+from LOCAL.utils import ffmpeg_progress, show_progress
+from LOCAL.probe import probe
+from LOCAL.audio import extract_audio
+from LOCAL.streams import plan, same_container
+from LOCAL.vp9 import vp9_args
 
-async def mp3(event, msg):
+async def convert_to(name, out, container, edit):
+    """Writes `name` to `out` as `container`, copying the streams that fit it."""
+    metadata = await probe(name)
+    if same_container(metadata, container):
+        return link(name, out)
+    video = vp9_args(metadata["width"], VP9_SPEED) if container == "webm" else None
+    args, copy = plan(metadata, container, video)
+    if container == "mp4":
+        args += ["-movflags", "+faststart"]
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", name] + args + [out, "-y"]
+    if copy:
+        # a remux only moves packets around, it doesn't need an encode slot
+        return await ffmpeg_progress(cmd, metadata["duration"], edit, "**CONVERTING:**")
+    async with scheduler.stage("encode"):
+        await ffmpeg_progress(cmd, metadata["duration"], edit, "**CONVERTING:**", run=run)
+
+def unique(display):
+    """Path to write an output shown as `display` to, jobs on files of the
+    same name run side by side and must not share it."""
+    return f"out_{time.time_ns()}_{display}"
+
+async def audio(event, msg, formats):
+    """Extracts the audio as every one of `formats` from a single ffmpeg run."""
     Drone = event.client
-    edit = await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id)
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id))
     x = msg.file.name
     mime = msg.file.mime_type
-    if x:
-        name = msg.file.name
-    elif 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
-    elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm"      
     if x:
         out = ((msg.file.name).split("."))[0]
     else:
         out = dt.now().isoformat("_", "seconds")
+    outs = [(fmt, unique(f"{out}.{fmt}")) for fmt in formats]
     try:
-        DT = time.time()
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
+        name = await inputs.acquire(msg, edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while downloading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
         await edit.edit("Converting.")
-        bash(f"ffmpeg -i {name} -codec:a libmp3lame -q:a 0 {out}.mp3")
+        async with scheduler.stage("encode"):
+            metadata = await probe(name)
+            if not metadata["audio_codec"]:
+                return await edit.edit("This file has no audio!")
+            await extract_audio(name, outs, metadata["audio_codec"], metadata["duration"],
+                                show_progress(edit, "**CONVERTING:**"))
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while converting!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
-        UT = time.time()
-        uploader = await fast_upload(f'{out}.mp3', f'{out}.mp3', UT, Drone, edit, '**UPLOADING:**')
-        await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**AUDIO EXTRACTED by** : @{BOT_UN}', force_document=True)
+        sent = []
+        for fmt, path in outs:
+            UT = time.time()
+            async with scheduler.stage("transfer"):
+                uploader = await fast_upload(path, f"{out}.{fmt}", UT, Drone, edit, '**UPLOADING:**')
+            sent.append(await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**AUDIO EXTRACTED by** : @{BOT_UN}', force_document=True))
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while uploading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
+    finally:
+        for fmt, path in outs:
+            if os.path.isfile(path):
+                os.remove(path)
     await edit.delete()
-    os.remove(name)
-    os.remove(f'{out}.mp3')                           
-                       
+    return sent[0] if len(sent) == 1 else sent
+
+async def mp3(event, msg):
+    return await audio(event, msg, ["mp3"])
+
 async def flac(event, msg):
-    Drone = event.client
-    edit = await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id)
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
-    x = msg.file.name
-    mime = msg.file.mime_type
-    if x:
-        name = msg.file.name
-    elif 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
-    elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm"      
-    if x:
-        out = ((msg.file.name).split("."))[0]
-    else:
-        out = dt.now().isoformat("_", "seconds")
-    try:
-        DT = time.time()
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
-    except Exception as e:
-        print(e)
-        return await edit.edit(f"An error occured while downloading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
-    try:
-        await edit.edit("Converting.")
-        bash(f"ffmpeg -i {name} -codec:a libmp3lame -q:a 0 {out}.mp3")
-        bash(f'ffmpeg -i {out}.mp3 -c:a flac {out}.flac')
-    except Exception as e:
-        print(e)
-        return await edit.edit(f"An error occured while converting!\n\nContact [SUPPORT]({SUPPORT_LINK})")
-    try:
-        UT = time.time()
-        uploader = await fast_upload(f'{out}.flac', f'{out}.flac', UT, Drone, edit, '**UPLOADING:**')
-        await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**AUDIO EXTRACTED by** : @{BOT_UN}', force_document=True)
-    except Exception as e:
-        print(e)
-        return await edit.edit(f"An error occured while uploading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
-    await edit.delete()
-    os.remove(name)
-    os.remove(f'{out}.mp3')                           
-    os.remove(f'{out}.flac')                 
+    return await audio(event, msg, ["flac"])
 
 async def wav(event, msg):
-    Drone = event.client
-    edit = await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id)
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
-    x = msg.file.name
-    mime = msg.file.mime_type
-    if x:
-        name = msg.file.name
-    elif 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
-    elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm"      
-    if x:
-        out = ((msg.file.name).split("."))[0]
-    else:
-        out = dt.now().isoformat("_", "seconds")
-    try:
-        DT = time.time()
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
-    except Exception as e:
-        print(e)
-        return await edit.edit(f"An error occured while downloading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
-    try:
-        await edit.edit("Converting.")
-        bash(f"ffmpeg -i {name} -codec:a libmp3lame -q:a 0 {out}.mp3")
-        bash(f'ffmpeg -i {out}.mp3 {out}.wav')
-    except Exception as e:
-        print(e)
-        return await edit.edit(f"An error occured while converting!\n\nContact [SUPPORT]({SUPPORT_LINK})")
-    try:
-        UT = time.time()
-        uploader = await fast_upload(f'{out}.wav', f'{out}.wav', UT, Drone, edit, '**UPLOADING:**')
-        await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**AUDIO EXTRACTED by** : @{BOT_UN}', force_document=True)
-    except Exception as e:
-        print(e)
-        return await edit.edit(f"An error occured while uploading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
-    await edit.delete()
-    os.remove(name)
-    os.remove(f'{out}.mp3')                           
-    os.remove(f'{out}.wav')                 
+    return await audio(event, msg, ["wav"])
                                        
 async def mp4(event, msg):
     Drone = event.client
-    edit = await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id)
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id))
     x = msg.file.name
     mime = msg.file.mime_type
-    if x:
-        name = msg.file.name
-    elif 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
-    elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm"      
     if x:
         out = ((msg.file.name).split("."))[0] 
     else:
         out = dt.now().isoformat("_", "seconds")
     try:
-        DT = time.time()
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
+        name = await inputs.acquire(msg, edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while downloading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
         await edit.edit("Converting.")
-        rename(name, f'{out}.mp4')
+        path = unique(f'{out}.mp4')
+        await convert_to(name, path, "mp4", edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while converting!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
         UT = time.time()
-        uploader = await fast_upload(f'{out}.mp4', f'{out}.mp4', UT, Drone, edit, '**UPLOADING:**')
-        await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**CONVERTED by** : @{BOT_UN}', force_document=True)
+        uploader = await fast_upload(path, f'{out}.mp4', UT, Drone, edit, '**UPLOADING:**')
+        sent = await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**CONVERTED by** : @{BOT_UN}', force_document=True)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while uploading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     await edit.delete()                           
-    os.remove(f'{out}.mp4')                 
+    os.remove(path)                 
+    return sent
                                            
 async def mkv(event, msg):
     Drone = event.client
-    edit = await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id)
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id))
     x = msg.file.name
     mime = msg.file.mime_type
-    if x:
-        name = msg.file.name
-    elif 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
-    elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm"      
     if x:
         out = ((msg.file.name).split("."))[0] + ".mkv"
     else:
         out = dt.now().isoformat("_", "seconds") + ".mkv"
     try:
-        DT = time.time()
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
+        name = await inputs.acquire(msg, edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while downloading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
         await edit.edit("Converting.")
-        rename(name, f'{out}')
+        path = unique(out)
+        await convert_to(name, path, "mkv", edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while converting!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
         UT = time.time()
-        uploader = await fast_upload(f'{out}', f'{out}', UT, Drone, edit, '**UPLOADING:**')
-        await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**CONVERTED by** : @{BOT_UN}', force_document=True)
+        uploader = await fast_upload(path, out, UT, Drone, edit, '**UPLOADING:**')
+        sent = await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**CONVERTED by** : @{BOT_UN}', force_document=True)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while uploading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     await edit.delete()                      
-    os.remove(f'{out}')
+    os.remove(path)
+    return sent
              
 async def webm(event, msg):
     Drone = event.client
-    edit = await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id)
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id))
     x = msg.file.name
     mime = msg.file.mime_type
-    if x:
-        name = msg.file.name
-    elif 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
-    elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm"      
     if x:
         out = ((msg.file.name).split("."))[0] + ".webm"
     else:
         out = dt.now().isoformat("_", "seconds") + ".webm"
     try:
-        DT = time.time()
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
+        name = await inputs.acquire(msg, edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while downloading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
         await edit.edit("Converting.")
-        rename(name, f'{out}')
+        path = unique(out)
+        await convert_to(name, path, "webm", edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while converting!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
         UT = time.time()
-        uploader = await fast_upload(f'{out}', f'{out}', UT, Drone, edit, '**UPLOADING:**')
-        await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**CONVERTED by** : @{BOT_UN}', force_document=True)
+        uploader = await fast_upload(path, out, UT, Drone, edit, '**UPLOADING:**')
+        sent = await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**CONVERTED by** : @{BOT_UN}', force_document=True)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while uploading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     await edit.delete()                    
-    os.remove(f'{out}')
+    os.remove(path)
+    return sent
              
 async def file(event, msg):
     Drone = event.client
-    edit = await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id)
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id))
     x = msg.file.name
     mime = msg.file.mime_type
     if x:
-        name = msg.file.name
+        display = msg.file.name
     elif 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
+        display = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
     elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
+        display = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
     elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
+        display = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
     elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm"      
+        display = "media_" + dt.now().isoformat("_", "seconds") + ".webm"      
     try:
-        DT = time.time()
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
+        name = await inputs.acquire(msg, edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while downloading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
         UT = time.time()
-        uploader = await fast_upload(f'{name}', f'{name}', UT, Drone, edit, '**UPLOADING:**')
-        await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**CONVERTED by** : @{BOT_UN}', force_document=True)
+        uploader = await fast_upload(name, display, UT, Drone, edit, '**UPLOADING:**')
+        sent = await Drone.send_file(event.chat_id, uploader, thumb=JPG, caption=f'**CONVERTED by** : @{BOT_UN}', force_document=True)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while uploading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     await edit.delete()
-    os.remove(name)                           
+    return sent
     
 async def video(event, msg):
     Drone = event.client
-    edit = await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id)
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process!", reply_to=msg.id))
     x = msg.file.name
     mime = msg.file.mime_type
-    if x:
-        name = msg.file.name
-    elif 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
-    elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
-    elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm"      
     if x:
         out = ((msg.file.name).split("."))[0] + '.mp4'
     else:
         out = dt.now().isoformat("_", "seconds") + '.mp4'
     try:
-        DT = time.time()
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
+        name = await inputs.acquire(msg, edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while downloading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
         await edit.edit("Converting.")
-        rename(name, f'{out}')
+        path = unique(out)
+        await convert_to(name, path, "mp4", edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while converting!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     try:
-        metadata = video_metadata(out)
+        metadata = await probe(path)
         width = metadata["width"]
         height = metadata["height"]
-        duration = metadata["duration"]
+        duration = int(metadata["duration"])
         attributes = [DocumentAttributeVideo(duration=duration, w=width, h=height, supports_streaming=True)]           
         UT = time.time()
-        uploader = await fast_upload(f'{out}', f'{out}', UT, Drone, edit, '**UPLOADING:**')
-        await Drone.send_file(event.chat_id, uploader, thumb=JPG2, caption=f'**CONVERTED by** : @{BOT_UN}', attributes=attributes, force_document=False)
+        uploader = await fast_upload(path, out, UT, Drone, edit, '**UPLOADING:**')
+        sent = await Drone.send_file(event.chat_id, uploader, thumb=JPG2, caption=f'**CONVERTED by** : @{BOT_UN}', attributes=attributes, force_document=False)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while uploading!\n\nContact [SUPPORT]({SUPPORT_LINK})")
     await edit.delete()
-    os.remove(out)                           
+    os.remove(path)
+    return sent
     
@@ -6,13 +6,21 @@ import glob
 from datetime import datetime as dt
 
 from telethon import events
-from telethon.tl.types import DocumentAttributeVideo
+from telethon.tl.types import DocumentAttributeVideo, DocumentAttributeFilename, InputMediaUploadedDocument
 from telethon.errors.rpcerrorlist import MessageNotModifiedError
-from ethon.telefunc import fast_download, fast_upload
-from ethon.pyfunc import video_metadata
+from ethon.telefunc import fast_upload
 from LOCAL.localisation import SUPPORT_LINK
-from LOCAL.utils import ffmpeg_progress
-from .. import BOT_UN, Drone
+from LOCAL.utils import ffmpeg_progress, show_progress
+from LOCAL.segments import encode_segments
+from LOCAL.probe import probe
+from LOCAL.streams import codec_args
+from LOCAL.ladder import ladder_cmd, rungs
+from .. import BOT_UN, Drone, LIVE_UPLOAD, SEGMENT_WORKERS
+from main.scheduler import scheduler
+from main.editor import editor
+from main.inputs import inputs
+from main.remote import run
+from main.upload import LiveUpload
 
 # Render-optimized settings
 RENDER_MODE = True
@@ -27,47 +35,33 @@ async def encode(event, msg, scale=0):
     temp_dir = "encodemedia"
     os.makedirs(temp_dir, exist_ok=True)
     temp_files = []
+    live = None
 
     try:
-        edit = await Drone.send_message(event.chat_id, "🔄 Starting (Render Optimized)...", reply_to=msg.id)
+        edit = editor.live(await Drone.send_message(event.chat_id, "🔄 Starting (Render Optimized)...", reply_to=msg.id))
 
-        # Determine input file
-        file = getattr(msg.media, "document", msg.media)
         mime = getattr(msg.file, "mime_type", "video/mp4")
         original_caption = msg.text or msg.message or ""
 
         # Create unique filenames
-        timestamp = int(time.time())
-        original_name = getattr(msg.file, "name", "")
-        ext = os.path.splitext(original_name)[1] if original_name else ".mp4"
-        
-        input_file = os.path.join(temp_dir, f"input_{timestamp}{ext}")
-        temp_files.append(input_file)
+        timestamp = time.time_ns()
 
-        # Download with Render optimizations
+        # Download, or reuse the copy another operation already downloaded.
+        # A streamed input is still downloading while ffmpeg reads it.
         start_dl = time.time()
-        await fast_download(input_file, file, Drone, edit, start_dl, "**DOWNLOADING:**")
-        dl_time = time.time() - start_dl
-        file_size = os.path.getsize(input_file)
-        dl_speed = file_size / dl_time / (1024*1024)  # MB/s
-
-        # Standardized filename
-        name = os.path.join(temp_dir, f"video_{timestamp}.mp4")
-        os.rename(input_file, name)
-        temp_files.append(name)
-
-        # Store original file size
-        original_size = os.path.getsize(name)
+        name, stream = await inputs.stream(msg, edit)
+        end_dl = time.time()
+        original_size = msg.file.size or os.path.getsize(name)
 
         # Extract metadata
         await safe_edit(edit, "📊 Analyzing video...")
-        vid = video_metadata(name)
+        vid = await probe(name) if stream is None else await stream.probe()
         if not vid:
             raise ValueError("Failed to extract video metadata.")
 
         width = int(vid['width'])
         height = int(vid['height'])
-        duration = vid['duration']
+        duration = vid['duration'] or msg.file.duration
         original_fps = float(vid.get("fps", 30))
 
         # Check if video already at requested resolution
@@ -85,48 +79,85 @@ async def encode(event, msg, scale=0):
         # Conservative FPS for Render CPU limits
         fps_cmd = ["-r", "24"] if original_fps > 30 else []
 
-        # Output and progress files
+        # Output file
         output_file = os.path.join(temp_dir, f"output_{timestamp}.mp4")
-        progress_file = os.path.join(temp_dir, f"progress_{timestamp}.txt")
-        temp_files.extend([output_file, progress_file])
+        temp_files.append(output_file)
+
+        # Fragmented MP4 can be uploaded part by part while it is encoded,
+        # faststart would rewrite the whole file at the end instead
+        if LIVE_UPLOAD:
+            live = LiveUpload(Drone, output_file, output_file)
+            output_cmd = ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", "pipe:1"]
+        else:
+            output_cmd = ["-movflags", "+faststart", output_file, "-y"]
 
         # RENDER-OPTIMIZED FFMPEG COMMAND
-        cmd = [
-            "ffmpeg", "-hide_banner", "-loglevel", "error",
-            "-progress", progress_file,
-            "-i", name
-        ] + fps_cmd + [
+        video_args = fps_cmd + [
             "-c:v", "libx264", 
             "-pix_fmt", "yuv420p", 
             "-preset", "medium",
             "-s", scale_cmd,
-            "-crf", "26",
-            "-c:a", "aac", "-ac", "2", "-ab", "64k",
-            "-c:s", "copy", 
-            "-movflags", "+faststart",
-            "-threads", "1",
-            output_file, "-y"
+            "-crf", "26"
         ]
+        # AAC is copied instead of encoded to AAC again, anything else becomes small stereo AAC
+        audio_args = ["-c:a", "copy"] if vid["audio_codec"] == "aac" else ["-c:a", "aac", "-ac", "2", "-ab", "64k"]
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-i", name if stream is None else "pipe:0"
+        ] + video_args + audio_args + codec_args(vid, "subtitle", "mp4") + [
+            "-threads", "1"
+        ] + output_cmd
+        output = live.write if live is not None else None
 
         # Run encoding with progress
-        await ffmpeg_progress(cmd, name, progress_file, time.time(), edit, '**ENCODING:**')
+        async with scheduler.stage("encode"):
+            start_enc = time.time()
+            segmented = False
+            # with cores to spare, encode segments of the video side by side, one
+            # process for our slot and one for every idle encode slot we hold meanwhile
+            if stream is None:
+                async with scheduler.spare("encode", 0 if SEGMENT_WORKERS else scheduler.stages["encode"].size) as extra:
+                    segmented = await encode_segments(name, video_args, audio_args + codec_args(vid, "subtitle", "mp4"),
+                                                      output_cmd, duration, SEGMENT_WORKERS or 1 + extra,
+                                                      callback=show_progress(edit, '**ENCODING:**'),
+                                                      stdout=output, run=run)
+            if not segmented:
+                await ffmpeg_progress(cmd, duration, edit, '**ENCODING:**', stdin=stream, stdout=output, run=run)
+            saved = stream.saved(start_enc, time.time()) if stream is not None else 0
+        if stream is not None:
+            end_dl = stream.entry.finished or time.time()
+        dl_time = max(end_dl - start_dl, 0.001)
+        dl_speed = original_size / dl_time / (1024*1024)  # MB/s
 
         # Get encoded file size
         encoded_size = os.path.getsize(output_file)
 
         # Prepare caption with Render info
         encoding_info = f"\n\n💎 Encoded • {scale}p\n📊 {original_size//1024//1024}MB → {encoded_size//1024//1024}MB\n⚡ Render Free Tier"
+        if saved >= 1:
+            encoding_info += f"\n⏱ Streaming saved {saved:.0f}s"
         final_caption = original_caption + encoding_info if original_caption else encoding_info.strip()
 
         # Optimized upload for Render
-        await safe_edit(edit, "📤 Uploading (Render Optimized)...")
         start_ul = time.time()
-        uploader = await fast_upload(output_file, output_file, start_ul, Drone, edit, '**UPLOADING:**')
-        ul_time = time.time() - start_ul
+        uploader = None
+        if live is not None:
+            # most parts went out during the encode already
+            await safe_edit(edit, "📤 Finishing upload...")
+            uploader = await live.finish()
+        if uploader is None:
+            await safe_edit(edit, "📤 Uploading (Render Optimized)...")
+            async with scheduler.stage("transfer"):
+                uploader = await fast_upload(output_file, output_file, start_ul, Drone, edit, '**UPLOADING:**')
+        ul_time = max(time.time() - start_ul, 0.001)
         ul_speed = encoded_size / ul_time / (1024*1024)
 
         # Log speeds for monitoring
         print(f"📊 Render Speeds - Download: {dl_speed:.2f} MB/s, Upload: {ul_speed:.2f} MB/s")
+        if live is not None:
+            print(f"📊 Upload finished {ul_time:.1f}s after the encode")
+        if stream is not None:
+            print(f"📊 Streaming saved {saved:.1f}s")
 
         # Get original thumbnail
         thumb = None
@@ -136,13 +167,13 @@ async def encode(event, msg, scale=0):
             thumb = msg.media.document.thumbs[-1]
 
         # Video attributes
-        metadata = video_metadata(output_file)
+        metadata = await probe(output_file)
         width = metadata["width"]
         height = metadata["height"]
-        duration = metadata["duration"]
+        duration = int(metadata["duration"])
         attributes = [DocumentAttributeVideo(duration=duration, w=width, h=height, supports_streaming=True)]
 
-        await Drone.send_file(
+        sent = await Drone.send_file(
             event.chat_id,
             uploader,
             caption=final_caption,
@@ -152,6 +183,7 @@ async def encode(event, msg, scale=0):
         )
 
         await edit.delete()
+        return sent
 
     except Exception as e:
         print(f"Render encoding error: {e}")
@@ -159,6 +191,67 @@ async def encode(event, msg, scale=0):
             await safe_edit(edit, f"❌ Render Limit Hit\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)
         except:
             pass
+    finally:
+        if live is not None:
+            live.cancel()
+        await clean_temp_files(temp_files)
+
+async def ladder(event, msg):
+    """
+    Encodes every resolution below the source from one decode and sends them as an album
+    """
+    temp_dir = "encodemedia"
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_files = []
+
+    try:
+        edit = editor.live(await Drone.send_message(event.chat_id, "🔄 Starting...", reply_to=msg.id))
+        original_caption = msg.text or msg.message or ""
+        timestamp = time.time_ns()
+
+        name, stream = await inputs.stream(msg, edit)
+        await safe_edit(edit, "📊 Analyzing video...")
+        vid = await probe(name) if stream is None else await stream.probe()
+        heights = rungs(int(vid['height']))
+        if not heights:
+            return await safe_edit(edit, "The video is already 240p or smaller.")
+        duration = vid['duration'] or msg.file.duration
+        fps_cmd = ["-r", "24"] if float(vid.get("fps", 30)) > 30 else []
+
+        outs = [(h, os.path.join(temp_dir, f"output_{timestamp}_{h}p.mp4")) for h in heights]
+        temp_files += [out for _, out in outs]
+        video_args = fps_cmd + ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "medium", "-crf", "26"]
+        audio_args = ["-c:a", "copy"] if vid["audio_codec"] == "aac" else ["-c:a", "aac", "-ac", "2", "-ab", "64k"]
+        cmd = ladder_cmd(name if stream is None else "pipe:0", outs, video_args, audio_args)
+
+        # one decode feeds all renditions
+        async with scheduler.stage("encode"):
+            await ffmpeg_progress(cmd, duration, edit, '**ENCODING:**', stdin=stream, run=run)
+
+        media = []
+        for height, out in outs:
+            await safe_edit(edit, f"📤 Uploading {height}p...")
+            async with scheduler.stage("transfer"):
+                uploader = await fast_upload(out, out, time.time(), Drone, edit, '**UPLOADING:**')
+            metadata = await probe(out)
+            attributes = [DocumentAttributeVideo(duration=int(metadata["duration"]), w=metadata["width"],
+                                                 h=metadata["height"], supports_streaming=True),
+                          DocumentAttributeFilename(f"{height}p.mp4")]
+            media.append(InputMediaUploadedDocument(uploader, "video/mp4", attributes))
+
+        captions = [f"💎 Encoded • {height}p" for height in heights]
+        if original_caption:
+            captions[0] = original_caption + "\n\n" + captions[0]
+        sent = await Drone.send_file(event.chat_id, media, caption=captions)
+        await edit.delete()
+        return sent
+
+    except Exception as e:
+        print(f"Ladder encoding error: {e}")
+        try:
+            await safe_edit(edit, f"An error occured while encoding.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)
+        except:
+            pass
     finally:
         await clean_temp_files(temp_files)
 
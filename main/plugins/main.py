@@ -12,7 +12,7 @@
 #
 #  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
 
-import os
+import math
 
 from telethon import events, Button
 
@@ -21,9 +21,69 @@ from .. import Drone
 from main.plugins.rename import media_rename
 from main.plugins.compressor import compress
 from main.plugins.trimmer import trim
-from main.plugins.convertor import mp3, flac, wav, mp4, mkv, webm, file, video
-from main.plugins.encoder import encode
-from main.plugins.ssgen import screenshot
+from main.plugins.convertor import audio, mp3, flac, wav, mp4, mkv, webm, file, video
+from main.plugins.encoder import encode, ladder
+from main.plugins.ssgen import screenshot, sheet
+from main.scheduler import scheduler, current_job, QueueFull
+from main.editor import editor
+from main.cache import results, document_id, own_caption
+from main.inputs import inputs
+
+from LOCAL.utils import humanbytes
+from LOCAL.trim import ranges, seconds
+
+async def cached(event, msg, op, fn, *args, **kwargs):
+    """Answers from the result cache when `op` was already done on this file."""
+    if await results.send(event, msg, op) is None:
+        inputs.claim(msg)
+        async with inputs.session():
+            await results.store(msg, op, await fn(event, msg, *args, **kwargs))
+
+async def deliver(job, msg, sent):
+    """Sends the result of `job` on `msg` to everyone who joined it."""
+    for status in job.subscribers:
+        try:
+            if sent is None:
+                await status.edit("The job you were waiting for failed, try again!")
+                continue
+            # some jobs answer with several messages
+            for message in (sent if isinstance(sent, list) else [sent]):
+                await status.client.send_file(status.chat_id, message.media, caption=own_caption(msg, message), reply_to=status.reply_to_msg_id)
+            await status.delete()
+        except Exception as e:
+            print(e)
+
+async def enqueue(event, name, fn, **kwargs):
+    button = await event.get_message()
+    msg = await button.get_reply_message()
+    if await results.send(event, msg, name) is not None:
+        return await event.delete()
+    inputs.claim(msg)
+    doc_id = document_id(msg)
+    key = (doc_id, name) if doc_id is not None else None
+    if key is not None and scheduler.find(key) is not None:
+        await event.delete()
+        status = editor.live(await event.client.send_message(event.chat_id, "This file is already being processed for someone, you will get the same result.", reply_to=msg.id))
+        if scheduler.join(key, status) is not None:
+            return
+        # finished while we were answering
+        await status.delete()
+        if await results.send(event, msg, name) is not None:
+            return
+    async def job():
+        await event.delete()
+        sent = None
+        try:
+            async with inputs.session():
+                sent = await fn(event, msg, **kwargs)
+            await results.store(msg, name, sent)
+        finally:
+            # the ones waiting on a failed job hear about it too
+            await deliver(current_job.get(), msg, sent)
+    try:
+        scheduler.submit(name, job, user=event.sender_id, notice=event, key=key)
+    except QueueFull as e:
+        await event.edit(f"Queue is full, try again later!\n\n`{e}`")
 
 @Drone.on(events.NewMessage(incoming=True,func=lambda e: e.is_private))
 async def compin(event):
@@ -32,6 +92,7 @@ async def compin(event):
         if media:
             video = event.file.mime_type
             if 'video' in video:
+                inputs.prefetch(event.message)
                 await event.reply("📽",
                             buttons=[
                                 [Button.inline("ENCODE", data="encode"),
@@ -62,6 +123,8 @@ async def _encode(event):
                          Button.inline("720p", data="720")],
                         [Button.inline("x264", data="264"),
                          Button.inline("x265", data="265")],
+                        [Button.inline("VP9 WEBM", data="vp9"),
+                         Button.inline("ALL SIZES", data="ladder")],
                         [Button.inline("BACK", data="back")]])
                          
 @Drone.on(events.callbackquery.CallbackQuery(data="compress"))
@@ -70,6 +133,8 @@ async def _compress(event):
                     buttons=[
                         [Button.inline("HEVC COMPRESS", data="hcomp"),
                          Button.inline("FAST COMPRESS", data="fcomp")],
+                        [Button.inline("AV1 COMPRESS", data="acomp"),
+                         Button.inline("TARGET SIZE", data="tcomp")],
                         [Button.inline("BACK", data="back")]])
                                           
 @Drone.on(events.callbackquery.CallbackQuery(data="convert"))
@@ -79,6 +144,7 @@ async def convert(event):
                         [Button.inline("MP3", data="mp3"),
                          Button.inline("FLAC", data="flac"),
                          Button.inline("WAV", data="wav")],
+                        [Button.inline("MP3 + FLAC + WAV", data="audio")],
                         [Button.inline("MP4", data="mp4"),
                          Button.inline("WEBM", data="webm"),
                          Button.inline("MKV", data="mkv")],
@@ -100,77 +166,52 @@ async def back(event):
 
 @Drone.on(events.callbackquery.CallbackQuery(data="mp3"))
 async def vtmp3(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message() 
-    if not os.path.isdir("audioconvert"):
-        await event.delete()
-        os.mkdir("audioconvert")
-        await mp3(event, msg)
-        if os.path.isdir("audioconvert"):
-            os.rmdir("audioconvert")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "mp3", mp3)
         
 @Drone.on(events.callbackquery.CallbackQuery(data="flac"))
 async def vtflac(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message()  
-    if not os.path.isdir("audioconvert"):
-        await event.delete()
-        os.mkdir("audioconvert")
-        await flac(event, msg)
-        if os.path.isdir("audioconvert"):
-            os.rmdir("audioconvert")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "flac", flac)
         
 @Drone.on(events.callbackquery.CallbackQuery(data="wav"))
 async def vtwav(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message() 
-    if not os.path.isdir("audioconvert"):
-        await event.delete()
-        os.mkdir("audioconvert")
-        await wav(event, msg)
-        if os.path.isdir("audioconvert"):
-            os.rmdir("audioconvert")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "wav", wav)
         
+@Drone.on(events.callbackquery.CallbackQuery(data="audio"))
+async def vtaudio(event):
+    await enqueue(event, "audio", audio, formats=("mp3", "flac", "wav"))
+
 @Drone.on(events.callbackquery.CallbackQuery(data="mp4"))
 async def vtmp4(event):
     button = await event.get_message()
     msg = await button.get_reply_message() 
     await event.delete()
-    await mp4(event, msg)
+    await cached(event, msg, "mp4", mp4)
     
 @Drone.on(events.callbackquery.CallbackQuery(data="mkv"))
 async def vtmkv(event):
     button = await event.get_message()
     msg = await button.get_reply_message() 
     await event.delete()
-    await mkv(event, msg)  
+    await cached(event, msg, "mkv", mkv)  
     
 @Drone.on(events.callbackquery.CallbackQuery(data="webm"))
 async def vtwebm(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message() 
-    await event.delete()
-    await webm(event, msg)  
+    # unless the codecs fit WebM already this is a full VP9 encode, queue it
+    await enqueue(event, "webm", webm)
     
 @Drone.on(events.callbackquery.CallbackQuery(data="file"))
 async def vtfile(event):
     button = await event.get_message()
     msg = await button.get_reply_message() 
     await event.delete()
-    await file(event, msg)    
+    await cached(event, msg, "file", file)    
 
 @Drone.on(events.callbackquery.CallbackQuery(data="video"))
 async def ftvideo(event):
     button = await event.get_message()
     msg = await button.get_reply_message() 
     await event.delete()
-    await video(event, msg)
+    await cached(event, msg, "video", video)
     
 @Drone.on(events.callbackquery.CallbackQuery(data="rename"))
 async def rename(event):                            
@@ -189,120 +230,111 @@ async def rename(event):
         except Exception as e: 
             print(e)
             return await cm.edit("An error occured while waiting for the response.")
-    await media_rename(event, msg, new_name)                     
+    async with inputs.session():
+        await media_rename(event, msg, new_name)                     
                    
 @Drone.on(events.callbackquery.CallbackQuery(data="hcomp"))
 async def hcomp(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message()  
-    if not os.path.isdir("encodemedia"):
-        await event.delete()
-        os.mkdir("encodemedia")
-        await compress(event, msg, ffmpeg_cmd=1)
-        if os.path.isdir("encodemedia"):
-            os.rmdir("encodemedia")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "hcomp", compress, ffmpeg_cmd=1)
  
 @Drone.on(events.callbackquery.CallbackQuery(data="fcomp"))
 async def fcomp(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message()  
-    if not os.path.isdir("encodemedia"):
-        await event.delete()
-        os.mkdir("encodemedia")
-        await compress(event, msg, ffmpeg_cmd=2)
-        if os.path.isdir("encodemedia"):
-            os.rmdir("encodemedia")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "fcomp", compress, ffmpeg_cmd=2)
   
+@Drone.on(events.callbackquery.CallbackQuery(data="acomp"))
+async def acomp(event):
+    await enqueue(event, "acomp", compress, ffmpeg_cmd=6)
+
+@Drone.on(events.callbackquery.CallbackQuery(data="tcomp"))
+async def tcomp(event):
+    markup = event.client.build_reply_markup(Button.force_reply())
+    async with Drone.conversation(event.chat_id) as conv: 
+        try:
+            xx = await conv.send_message("send me the size in MB the video has to fit in as a reply to this. \n\nFor eg: `50`", buttons=markup)
+            x = await conv.get_reply()
+            await xx.delete()
+            size = float(x.text)
+            # float() takes inf and nan too
+            if not math.isfinite(size) or size <= 0:
+                raise ValueError(x.text)
+        except ValueError:
+            return await event.client.send_message(event.chat_id, "Invalid size, send it as a number of MB.")
+        except Exception as e: 
+            print(e)
+            return await xx.edit("An error occured while waiting for the response.")
+    await enqueue(event, f"tcomp {size:g}", compress, ffmpeg_cmd=7, target=size)
+
 @Drone.on(events.callbackquery.CallbackQuery(data="265"))
 async def _265(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message()  
-    if not os.path.isdir("encodemedia"):
-        await event.delete()
-        os.mkdir("encodemedia")
-        await compress(event, msg, ffmpeg_cmd=3, ps_name="**ENCODING:**")
-        if os.path.isdir("encodemedia"):
-            os.rmdir("encodemedia")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "x265", compress, ffmpeg_cmd=3, ps_name="**ENCODING:**")
         
 @Drone.on(events.callbackquery.CallbackQuery(data="264"))
 async def _264(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message()  
-    if not os.path.isdir("encodemedia"):
-        await event.delete()
-        os.mkdir("encodemedia")
-        await compress(event, msg, ffmpeg_cmd=4, ps_name="**ENCODING:**")
-        if os.path.isdir("encodemedia"):
-            os.rmdir("encodemedia")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "x264", compress, ffmpeg_cmd=4, ps_name="**ENCODING:**")
+
+@Drone.on(events.callbackquery.CallbackQuery(data="ladder"))
+async def _ladder(event):
+    await enqueue(event, "ladder", ladder)
+
+@Drone.on(events.callbackquery.CallbackQuery(data="vp9"))
+async def _vp9(event):
+    await enqueue(event, "vp9", compress, ffmpeg_cmd=5, ps_name="**ENCODING:**")
     
 
 @Drone.on(events.callbackquery.CallbackQuery(data="240"))
 async def _240(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message()  
-    if not os.path.isdir("encodemedia"):
-        await event.delete()
-        os.mkdir("encodemedia")
-        await encode(event, msg, scale=240)
-        if os.path.isdir("encodemedia"):
-            os.rmdir("encodemedia")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "240p", encode, scale=240)
         
 @Drone.on(events.callbackquery.CallbackQuery(data="360"))
 async def _360(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message()  
-    if not os.path.isdir("encodemedia"):
-        await event.delete()
-        os.mkdir("encodemedia")
-        await encode(event, msg, scale=360)
-        if os.path.isdir("encodemedia"):
-            os.rmdir("encodemedia")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "360p", encode, scale=360)
         
 @Drone.on(events.callbackquery.CallbackQuery(data="480"))
 async def _480(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message()  
-    if not os.path.isdir("encodemedia"):
-        await event.delete()
-        os.mkdir("encodemedia")
-        await encode(event, msg, scale=480)
-        if os.path.isdir("encodemedia"):
-            os.rmdir("encodemedia")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "480p", encode, scale=480)
         
 @Drone.on(events.callbackquery.CallbackQuery(data="720"))
 async def _720(event):
-    button = await event.get_message()
-    msg = await button.get_reply_message()  
-    if not os.path.isdir("encodemedia"):
-        await event.delete()
-        os.mkdir("encodemedia")
-        await encode(event, msg, scale=720)
-        if os.path.isdir("encodemedia"):
-            os.rmdir("encodemedia")
-    else:
-        await event.edit("Another process in progress!")
+    await enqueue(event, "720p", encode, scale=720)
         
 @Drone.on(events.callbackquery.CallbackQuery(data="sshots"))
 async def ss_(event):
     button = await event.get_message()
     msg = await button.get_reply_message()
     await event.delete()
-    await screenshot(event, msg) 
+    markup = event.client.build_reply_markup(Button.force_reply())
+    times, count, best, grid = None, 10, False, False
+    async with Drone.conversation(event.chat_id) as conv: 
+        try:
+            xx = await conv.send_message("send me how many screenshots you want (up to 30), or the times to take them at as a reply to this. \n\nIn format hh:mm:ss , for eg: `00:01:20, 00:10:05` \n\nSend `best` or eg: `best 6` to get the most telling frames, `sheet` or eg: `sheet 20` for them all in one picture, /skip for the usual 10.", buttons=markup)
+            x = await conv.get_reply()
+            await xx.delete()
+            text = (x.text or "").strip()
+            if text.lower().startswith("sheet"):
+                grid, text = True, text[5:].strip()
+                count = min(max(int(text), 1), 36) if text.isdigit() else 16
+            elif text.lower().startswith("best"):
+                best, text = True, text[4:].strip()
+                if text.isdigit():
+                    count = min(max(int(text), 1), 30)
+            elif text.isdigit():
+                count = min(max(int(text), 1), 30)
+            elif text and text != "/skip":
+                times = [seconds(t) for t in text.replace("\n", ",").split(",") if t.strip()][:30]
+        except ValueError:
+            return await event.client.send_message(event.chat_id, "Invalid time, send it as hh:mm:ss")
+        except Exception as e: 
+            print(e)
+            return await xx.edit("An error occured while waiting for the response.")
+    async with inputs.session():
+        if grid:
+            return await sheet(event, msg, count)
+        await screenshot(event, msg, times, count, best)
     
+def trim_key(cuts):
+    # from the parsed seconds, so `90` and `1:30` share a result and close times don't
+    return "trim " + ",".join(f"{a:.3f}-{b:.3f}" for a, b in cuts)
+
 @Drone.on(events.callbackquery.CallbackQuery(data="trim"))
 async def vtrim(event):                            
     button = await event.get_message()
@@ -311,7 +343,7 @@ async def vtrim(event):
     markup = event.client.build_reply_markup(Button.force_reply())
     async with Drone.conversation(event.chat_id) as conv: 
         try:
-            xx = await conv.send_message("send me the start time of the video you want to trim from as a reply to this. \n\nIn format hh:mm:ss , for eg: `01:20:69` ", buttons=markup)
+            xx = await conv.send_message("send me the start time of the video you want to trim from as a reply to this. \n\nIn format hh:mm:ss , for eg: `01:20:69` \n\nOr several ranges to join into one video, for eg: `00:01:00-00:01:30, 00:05:10-00:05:40` ", buttons=markup)
             x = await conv.get_reply()
             st = x.text
             await xx.delete()                    
@@ -320,6 +352,12 @@ async def vtrim(event):
         except Exception as e: 
             print(e)
             return await xx.edit("An error occured while waiting for the response.")
+        if "-" in st:
+            try:
+                cuts = ranges(st)
+            except ValueError as e:
+                return await event.client.send_message(event.chat_id, f"Invalid ranges: `{e}`")
+            return await cached(event, msg, trim_key(cuts), trim, cuts)
         try:
             xy = await conv.send_message("send me the end time of the video you want to trim till as a reply to this.  \n\nIn format hh:mm:ss , for eg: `01:20:69` ", buttons=markup)
             y = await conv.get_reply()
@@ -330,5 +368,28 @@ async def vtrim(event):
         except Exception as e: 
             print(e)
             return await xy.edit("An error occured while waiting for the response.")
-        await trim(event, msg, st, et)
-            
+        try:
+            cuts = ranges(f"{st}-{et}")
+        except ValueError as e:
+            return await event.client.send_message(event.chat_id, f"Invalid time: `{e}`")
+        await cached(event, msg, trim_key(cuts), trim, cuts)
+
+@Drone.on(events.NewMessage(incoming=True, pattern="/queue"))
+async def queue_stats(event):
+    st = scheduler.stats()
+    cache = await results.stats()
+    kept = inputs.stats()
+    await event.reply(f"**QUEUE**\n\n"
+                      f"Slots: `{st['slots']}`\n"
+                      f"Running: `{st['running']}`\n"
+                      f"Waiting: `{st['queued']}` from `{st['users']}` users\n\n"
+                      f"Completed: `{st['completed']}` • Failed: `{st['failed']}` • Joined: `{st['coalesced']}`\n"
+                      f"Avg wait: `{st['avg_wait']:.1f}s` • p95 wait: `{st['p95_wait']:.1f}s`\n"
+                      f"Avg run: `{st['avg_run']:.1f}s`\n"
+                      f"Throughput: `{st['throughput']:.1f}` jobs/hour\n\n"
+                      + "\n".join(f"{name.capitalize()}: `{stage['busy']}/{stage['size']}` busy, `{stage['utilisation']:.0%}` utilised"
+                                  for name, stage in st['stages'].items())
+                      + f"\n\nEdits: `{editor.sent}` sent, `{editor.skipped}` coalesced, `{editor.floods}` flood waits"
+                      + f"\nCache: `{cache['entries']}` results, `{cache['hits']}` hits, `{cache['hit_rate']:.0%}` hit rate"
+                      + f"\nInputs: `{kept['files']}` files, `{humanbytes(kept['used'])}`, `{kept['hits']}` reused, `{kept['misses']}` downloaded"
+                      + f"\nPrefetch: `{kept['prefetched']}` started, `{kept['prefetch_used']}` used, `{kept['prefetch_wasted']}` wasted")
@@ -17,17 +17,18 @@ import os, time
 from datetime import datetime as dt
 from telethon import events
 from telethon.tl.types import DocumentAttributeVideo
-from ethon.telefunc import fast_download, fast_upload
-from ethon.pyutils import rename
-from ethon.pyfunc import video_metadata
+from ethon.telefunc import fast_upload
 
 from .. import Drone, BOT_UN
+from main.editor import editor
+from main.inputs import inputs, link
 
 from LOCAL.localisation import SUPPORT_LINK
 from LOCAL.localisation import JPG3 as t
+from LOCAL.probe import probe
 
 async def media_rename(event, msg, new_name):
-    edit = await event.client.send_message(event.chat_id, 'Trying to process.', reply_to=msg.id)
+    edit = editor.live(await event.client.send_message(event.chat_id, 'Trying to process.', reply_to=msg.id))
     try:
         if os.path.exists(f'./{event.sender_id}.jpg'):
             THUMB = f'./{event.sender_id}.jpg'
@@ -37,81 +38,50 @@ async def media_rename(event, msg, new_name):
         THUMB = t
     Drone = event.client
     DT = time.time()
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
     mime = msg.file.mime_type
     if 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
         out = new_name + ".mp4"
     elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
         out = new_name + ".mp4"
     elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
         out = new_name + ".mkv"            
     elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm" 
         out = new_name + ".webm"
     elif 'zip' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".zip" 
         out = new_name + ".zip"            
     elif 'jpg' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".jpg" 
         out = new_name + ".jpg"
     elif 'png' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".png"
         out = new_name + ".png"
     elif 'pdf' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".pdf" 
         out = new_name + ".pdf"
     elif 'rar' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".rar"
         out = new_name + ".rar"
     elif 'mp3' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp3" 
         out = new_name + ".mp3"
     elif 'ogg' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".ogg" 
         out = new_name + ".ogg"          
     elif 'flac' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".flac"  
         out = new_name + ".flac"
     elif 'wav' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".wav" 
         out = new_name + ".wav"
     elif 'webp' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webp" 
         out = new_name + ".webp"
     else:
         default_name = msg.file.name
         if not default_name:
-            await edit.edit("Failed fetching extension of your file.")
-        else:
-            try:
-                name = msg.file.name
-                ext = (name.split("."))[1]
-                out = new_name + "." + ext
-                await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
-                rename(name, out)
-                UT = time.time()
-                uploader = await fast_upload(out, out, UT, Drone, edit, '**UPLOADING:**')
-                net_time = round(DT - UT)
-                await Drone.send_file(event.chat_id, uploader, caption=f"**Renamed by** : @{BOT_UN}\n\nTotal time:{net_time} seconds.", thumb=THUMB, force_document=True)
-            except Exception as e:
-                await edit.edit(f"An error occured.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)
-                print(e)
-                return
+            return await edit.edit("Failed fetching extension of your file.")
+        ext = (default_name.split("."))[1]
+        out = new_name + "." + ext
     try:  
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
+        name = await inputs.acquire(msg, edit)
     except Exception as e:
         await edit.edit(f"An error occured while downloading.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)
         print(e)
         return
     await edit.edit("Renaming.")
     try:
-        rename(name, out)
+        link(name, out)
     except Exception as e:
         await edit.edit(f"An error occured while renaming.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)
         print(e)
@@ -124,20 +94,20 @@ async def media_rename(event, msg, new_name):
             await Drone.send_file(event.chat_id, uploader, caption=f"**Renamed by** : @{BOT_UN}\n\nTotal time:{net_time} seconds.", thumb=THUMB, force_document=True)
         else:
             if 'mp4' in mime:
-                metadata = video_metadata(out)
+                metadata = await probe(out)
                 width = metadata["width"]
                 height = metadata["height"]
-                duration = metadata["duration"]
+                duration = int(metadata["duration"])
                 attributes = [DocumentAttributeVideo(duration=duration, w=width, h=height, supports_streaming=True)]
                 UT = time.time()
                 uploader = await fast_upload(f'{out}', f'{out}', UT, Drone, edit, '**UPLOADING:**')
                 net_time = round(DT - UT)
                 await Drone.send_file(event.chat_id, uploader, caption=f"**Renamed by** : @{BOT_UN}\n\nTotal time:{net_time} seconds.", thumb=THUMB, attributes=attributes, force_document=False)
             elif msg.video:
-                metadata = video_metadata(out)
+                metadata = await probe(out)
                 width = metadata["width"]
                 height = metadata["height"]
-                duration = metadata["duration"]
+                duration = int(metadata["duration"])
                 attributes = [DocumentAttributeVideo(duration=duration, w=width, h=height, supports_streaming=True)]
                 UT = time.time()
                 uploader = await fast_upload(f'{out}', f'{out}', UT, Drone, edit, '**UPLOADING:**')
@@ -12,73 +12,82 @@
 #
 #  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
 
-import os, time, subprocess, asyncio
+import os, time, shutil
 
-from datetime import datetime as dt
 from telethon import events
-from ethon.telefunc import fast_download
-from ethon.pyfunc import video_metadata
+
+from main.editor import editor
+from main.inputs import inputs
+from main.scheduler import scheduler
+
+from LOCAL.probe import probe
+from LOCAL.shots import screenshots, spread
+from LOCAL.frames import best_times, contact_sheet
+
+# ffmpeg runs grabbing screenshots side by side
+WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
 
 def hhmmss(seconds):
     x = time.strftime('%H:%M:%S',time.gmtime(seconds))
     return x
 
-async def ssgen(video, time_stamp):
-    out = dt.now().isoformat("_", "seconds") + ".jpg"
-    cmd = ["ffmpeg",
-           "-ss",
-           f"{hhmmss(time_stamp)}", 
-           "-i",
-           f"{video}",
-           "-frames:v",
-           "1", 
-           f"{out}",
-           "-y"
-          ]
-    process = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-        
-    stdout, stderr = await process.communicate()
-    x = stderr.decode().strip()
-    y = stdout.decode().strip()
-    if os.path.isfile(out):
-        return out
-    else:
-        None       
-        
-async def screenshot(event, msg):
+async def screenshot(event, msg, times=None, count=10, best=False):
+    """Sends screenshots at `times` seconds, or `count` spread over the video,
+    or with `best` the `count` most telling frames of it."""
+    Drone = event.client
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process.", reply_to=msg.id))
+    try:
+        name = await inputs.acquire(msg, edit)
+    except Exception as e:
+        print(e)
+        return await edit.edit(f"An error occured while downloading.") 
+    duration = (await probe(name))["duration"]
+    if times is None and best:
+        await edit.edit("Looking for the best frames.")
+        try:
+            # decoding every keyframe is CPU work like an encode
+            async with scheduler.stage("encode"):
+                times = await best_times(name, count) or None
+        except Exception as e:
+            print(e)
+    if times is None:
+        times = spread(duration, count)
+    times = [t for t in times if t < duration] or [duration / 2]
+    folder = f"shots_{msg.id}_{time.time_ns()}"
+
+    async def progress(done):
+        await edit.edit(f"`{done}` screenshot generated.")
+    try:
+        shots = await screenshots(name, times, folder, WORKERS, callback=progress)
+        pictures = [out for _, out in shots]
+        captions = [f'screenshot at {hhmmss(t)}' for t, _ in shots]
+        if len(pictures) > 0:
+            await Drone.send_file(event.chat_id, pictures, caption=captions)
+        else:
+            return await edit.edit("No screenshots could be generated!")
+        await edit.delete()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+async def sheet(event, msg, count=16):
+    """Sends one picture with `count` frames of the video in a grid."""
     Drone = event.client
-    name = dt.now().isoformat("_", "seconds") + ".mp4"
-    edit = await Drone.send_message(event.chat_id, "Trying to process.", reply_to=msg.id)
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
-    if msg.file.name:
-        name = msg.file.name
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process.", reply_to=msg.id))
     try:
-        await fast_download(name, file, Drone, edit, time.time(), "**DOWNLOADING:**")
+        name = await inputs.acquire(msg, edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while downloading.") 
-    pictures = []
-    captions = []
-    n = [8, 7, 6, 5, 4, 3, 2, 1.5, 1.25, 1.10]
-    duration = (video_metadata(name))["duration"]
-    for i in range(10):
-        sshot = await ssgen(name, duration/n[i]) 
-        if sshot is not None:
-            pictures.append(sshot)
-            captions.append(f'screenshot at {hhmmss(duration/n[i])}')
-            await edit.edit(f"`{i+1}` screenshot generated.")
-    if len(pictures) > 0:
-        await Drone.send_file(event.chat_id, pictures, caption=captions)
-    else:
-        await edit.edit("No screenshots could be generated!")
-    await edit.delete()
-    for pic in pictures:
-        os.remove(pic)
-    os.remove(name)
+    out = f"sheet_{msg.id}_{time.time_ns()}.jpg"
+    try:
+        await edit.edit("Making the contact sheet.")
+        async with scheduler.stage("encode"):
+            frames = await contact_sheet(name, out, count)
+        await Drone.send_file(event.chat_id, out, caption=f"`{frames}` frames", force_document=False)
+        await edit.delete()
+    except Exception as e:
+        print(e)
+        await edit.edit("The contact sheet could not be generated!")
+    finally:
+        if os.path.isfile(out):
+            os.remove(out)
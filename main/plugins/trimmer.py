@@ -18,48 +18,45 @@ from datetime import datetime as dt
 from telethon import events
 from telethon.errors.rpcerrorlist import MessageNotModifiedError
 from telethon.tl.types import DocumentAttributeVideo
-from ethon.telefunc import fast_download, fast_upload
-from ethon.pyfunc import video_metadata, bash
+from ethon.telefunc import fast_upload
 from ethon.pyutils import rename
 
 from .. import Drone, BOT_UN
+from main.editor import editor
+from main.inputs import inputs
+from main.scheduler import scheduler
 
 from LOCAL.localisation import SUPPORT_LINK, JPG, JPG2, JPG3
+from LOCAL.probe import probe
+from LOCAL.trim import smart_trim
 
-async def trim(event, msg, st, et):
+async def trim(event, msg, cuts):
     Drone = event.client
-    edit = await Drone.send_message(event.chat_id, "Trying to process.", reply_to=msg.id)
-    new_name = "out_" + dt.now().isoformat("_", "seconds")
-    if hasattr(msg.media, "document"):
-        file = msg.media.document
-    else:
-        file = msg.media
+    edit = editor.live(await Drone.send_message(event.chat_id, "Trying to process.", reply_to=msg.id))
+    # several jobs can start within the same second, keep names apart
+    new_name = "out_" + dt.now().isoformat("_", "seconds") + f"_{time.time_ns() % 10**6}"
     mime = msg.file.mime_type
     if 'mp4' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
         out = new_name + ".mp4"
     elif msg.video:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mp4"
         out = new_name + ".mp4"
     elif 'x-matroska' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".mkv" 
         out = new_name + ".mkv"       
     elif 'webm' in mime:
-        name = "media_" + dt.now().isoformat("_", "seconds") + ".webm" 
         out = new_name + ".webm"
     else:
-        name = msg.file.name
-        ext = (name.split("."))[1]
-        out = new_name + ext
-    DT = time.time()
+        ext = (msg.file.name.split("."))[1]
+        out = new_name + "." + ext
     try:
-        await fast_download(name, file, Drone, edit, DT, "**DOWNLOADING:**")
+        name = await inputs.acquire(msg, edit)
     except Exception as e:
         print(e)
         return await edit.edit(f"An error occured while downloading.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False) 
     try:
         await edit.edit("Trimming.")
-        bash(f'ffmpeg -i {name} -ss {st} -to {et} -acodec copy -vcodec copy {out}')
+        # the edge GOPs are re-encoded, that counts against the encode limit
+        async with scheduler.stage("encode"):
+            await smart_trim(name, out, cuts)
         out2 = new_name + '_2_' + '.mp4'
         rename(out, out2)
     except Exception as e:
@@ -68,23 +65,23 @@ async def trim(event, msg, st, et):
     UT = time.time()
     text = f"**TRIMMED by :** @{BOT_UN}"
     try:
-        metadata = video_metadata(out2)
+        metadata = await probe(out2)
         width = metadata["width"]
         height = metadata["height"]
-        duration = metadata["duration"]
+        duration = int(metadata["duration"])
         attributes = [DocumentAttributeVideo(duration=duration, w=width, h=height, supports_streaming=True)]
         uploader = await fast_upload(f'{out2}', f'{out2}', UT, Drone, edit, '**UPLOADING:**')
-        await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG3, attributes=attributes, force_document=False)
+        sent = await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG3, attributes=attributes, force_document=False)
     except Exception:
         try:
             uploader = await fast_upload(f'{out2}', f'{out2}', UT, Drone, edit, '**UPLOADING:**')
-            await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG, force_document=True)
+            sent = await Drone.send_file(event.chat_id, uploader, caption=text, thumb=JPG, force_document=True)
         except Exception as e:
             print(e)
             return await edit.edit(f"An error occured while uploading.\n\nContact [SUPPORT]({SUPPORT_LINK})", link_preview=False)
     await edit.delete()
-    os.remove(name)
     os.remove(out2)
+    return sent
       
       
       
@@ -0,0 +1,23 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+from . import ENCODE_BROKER
+
+from LOCAL.broker import connect, remote
+from LOCAL.utils import run_ffmpeg
+
+# with a broker the encodes go to `python3 -m LOCAL.worker` processes,
+# `run` is used wherever run_ffmpeg would be
+broker = connect(ENCODE_BROKER) if ENCODE_BROKER else None
+run = remote(broker) if broker is not None else run_ffmpeg
@@ -0,0 +1,324 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import os, time, asyncio, heapq, itertools
+
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from . import WORKERS, TRANSFER_WORKERS, QUEUE_SIZE, USER_JOBS, ADMINS
+
+from main.editor import editor, mirrors
+
+from LOCAL.utils import time_formatter
+
+current_job = ContextVar("current_job", default=None)
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, id, name, fn, args, kwargs, user=None, tier=1, notice=None, key=None):
+        self.id = id
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.user = user
+        self.tier = tier
+        self.notice = notice
+        self.key = key
+        # status messages of requesters that joined this job
+        self.subscribers = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def wait_time(self):
+        return (self.started or time.time()) - self.submitted
+
+    @property
+    def run_time(self):
+        if self.started is None:
+            return 0
+        return (self.finished or time.time()) - self.started
+
+class FairQueue:
+    """Round-robin between users, lower tiers are always served first."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._turns = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def count(self, user):
+        return len(self._jobs.get(user, ()))
+
+    def put(self, job):
+        jobs = self._jobs.setdefault(job.user, deque())
+        if not jobs:
+            self._turns.setdefault(job.tier, deque()).append(job.user)
+        jobs.append(job)
+        self._size += 1
+
+    def get(self):
+        tier = min(t for t, users in self._turns.items() if users)
+        users = self._turns[tier]
+        user = users.popleft()
+        jobs = self._jobs[user]
+        job = jobs.popleft()
+        if jobs:
+            users.append(user)
+        else:
+            del self._jobs[user]
+        self._size -= 1
+        return job
+
+    def ordered(self):
+        """Waiting jobs in the order `get` would hand them out."""
+        out = []
+        for tier in sorted(self._turns):
+            users = deque(self._turns[tier])
+            jobs = {user: deque(self._jobs[user]) for user in users}
+            while users:
+                user = users.popleft()
+                out.append(jobs[user].popleft())
+                if jobs[user]:
+                    users.append(user)
+        return out
+
+class Stage:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.busy = 0
+        self.busy_time = 0.0
+        self._sem = None
+
+class JobScheduler:
+    """Runs heavy jobs on a fixed number of worker slots, queueing
+    the rest fairly between users instead of rejecting them.
+
+    Inside a job the network and CPU heavy steps are wrapped in
+    `stage("transfer")` and `stage("encode")`, which have their own pool
+    sizes, so one job can download while another encodes and a third
+    uploads."""
+
+    def __init__(self, encoders=0, transfers=2, maxsize=20, per_user=5, admins=()):
+        # every ffmpeg run is multi-threaded itself, so don't give each core its own slot
+        encoders = encoders or max(1, (os.cpu_count() or 1) // 2)
+        self.stages = {
+            "transfer": Stage("transfer", max(1, transfers)),
+            "encode": Stage("encode", encoders),
+        }
+        # enough jobs in flight to keep every stage busy
+        self.slots = sum(stage.size for stage in self.stages.values())
+        self.maxsize = maxsize
+        self.per_user = per_user
+        self.admins = set(admins)
+        self.running = {}
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.run_avg = None
+        self.waits = deque(maxlen=200)
+        self.coalesced = 0
+        self._keys = {}
+        self._ids = itertools.count(1)
+        self._queue = FairQueue()
+        self._ready = None
+        self._workers = []
+
+    def _start(self):
+        if self._ready is not None:
+            return
+        self._ready = asyncio.Semaphore(0)
+        self._since = time.time()
+        loop = asyncio.get_event_loop()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.slots)]
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def find(self, key):
+        """The queued or running job submitted with `key`, if any."""
+        return self._keys.get(key)
+
+    def join(self, key, status):
+        """Attaches `status` to the job with `key`: it gets the job's progress
+        edits and is listed in `job.subscribers`. Returns the job or None."""
+        job = self._keys.get(key)
+        if job is not None:
+            job.subscribers.append(status)
+            self.coalesced += 1
+        return job
+
+    def submit(self, name, fn, *args, user=None, notice=None, key=None, **kwargs):
+        """Queue `fn(*args, **kwargs)` for `user`, returns the Job.
+        `notice` is a message kept updated with the queue position, identical
+        requests submitted meanwhile can `join` the job through `key`.
+        Raises QueueFull when the queue or the user's share of it is full."""
+        self._start()
+        tier = 0 if user in self.admins else 1
+        if tier and self.depth >= self.maxsize:
+            raise QueueFull(f"{self.depth} jobs are already waiting")
+        if tier and self.per_user and self._queue.count(user) >= self.per_user:
+            raise QueueFull(f"{self.per_user} of your jobs are already waiting")
+        job = Job(next(self._ids), name, fn, args, kwargs, user, tier, notice, key)
+        if key is not None:
+            self._keys[key] = job
+        self._queue.put(job)
+        self._ready.release()
+        self._changed()
+        return job
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            job = self._queue.get()
+            job.started = time.time()
+            self.running[job.id] = job
+            if job.notice is not None:
+                editor.forget(job.notice)
+            self._changed()
+            token = current_job.set(job)
+            mirrored = mirrors.set(job.subscribers)
+            try:
+                await job.fn(*job.args, **job.kwargs)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Job #{job.id} {job.name} failed: {e}")
+            finally:
+                mirrors.reset(mirrored)
+                current_job.reset(token)
+                if job.key is not None:
+                    self._keys.pop(job.key, None)
+                job.finished = time.time()
+                del self.running[job.id]
+                self._record(job)
+                self._changed()
+                print(f"Job #{job.id} {job.name} for {job.user}: waited {job.wait_time:.1f}s, "
+                      f"ran {job.run_time:.1f}s, queue depth {self.depth}")
+
+    def _semaphore(self, stage):
+        if stage._sem is None:
+            stage._sem = asyncio.Semaphore(stage.size)
+        return stage._sem
+
+    @asynccontextmanager
+    async def stage(self, name):
+        """Holds a slot of the `name` pool for the duration of the block."""
+        stage = self.stages[name]
+        async with self._semaphore(stage):
+            stage.busy += 1
+            start = time.time()
+            try:
+                yield
+            finally:
+                stage.busy -= 1
+                stage.busy_time += time.time() - start
+
+    @asynccontextmanager
+    async def spare(self, name, most):
+        """Holds up to `most` more slots of the `name` pool, the ones free right
+        now, for the duration of the block, so a job can spread its work over
+        them without later jobs piling onto the same cores. Yields how many it
+        got, never waits for one."""
+        stage = self.stages[name]
+        sem = self._semaphore(stage)
+        taken = 0
+        start = time.time()
+        try:
+            while taken < most and not sem.locked():
+                await sem.acquire()
+                taken += 1
+                stage.busy += 1
+            yield taken
+        finally:
+            for _ in range(taken):
+                sem.release()
+            stage.busy -= taken
+            stage.busy_time += taken * (time.time() - start)
+
+    def _record(self, job):
+        self.wait_total += job.wait_time
+        self.run_total += job.run_time
+        self.waits.append(job.wait_time)
+        if self.run_avg is None:
+            self.run_avg = job.run_time
+        else:
+            self.run_avg = 0.7 * self.run_avg + 0.3 * job.run_time
+
+    def estimates(self):
+        """Yields (position, job, seconds until start) for the waiting jobs,
+        seconds is None until a job has finished and given a run time."""
+        avg = self.run_avg
+        free = [max(avg - job.run_time, 0) if avg else 0 for job in self.running.values()]
+        free += [0] * max(self.slots - len(free), 0)
+        heapq.heapify(free)
+        for pos, job in enumerate(self._queue.ordered(), 1):
+            t = heapq.heappop(free)
+            yield pos, job, t if avg is not None else None
+            heapq.heappush(free, t + (avg or 0))
+
+    def _changed(self):
+        """Updates the notices of the waiting jobs, unchanged ones are skipped by the editor."""
+        for pos, job, eta in self.estimates():
+            if job.notice is None:
+                continue
+            if eta is None:
+                start = "unknown"
+            elif eta < 1:
+                start = "a moment"
+            else:
+                start = time_formatter(eta * 1000)
+            editor.request(job.notice, f"Position `{pos}` in queue, est. start in `{start}`.")
+
+    def stats(self):
+        done = self.completed + self.failed
+        waits = sorted(self.waits)
+        uptime = time.time() - self._since if self._ready is not None else 0
+        return {
+            "slots": self.slots,
+            "running": len(self.running),
+            "queued": self.depth,
+            "users": len({job.user for job in self._queue.ordered()}),
+            "completed": self.completed,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "avg_wait": self.wait_total / done if done else 0,
+            "p95_wait": waits[int(0.95 * (len(waits) - 1))] if waits else 0,
+            "avg_run": self.run_total / done if done else 0,
+            # jobs per hour the encode slots can sustain at the measured run time,
+            # the other slots only let downloads and uploads overlap with them
+            "throughput": self.stages["encode"].size * 3600 * done / self.run_total if self.run_total else 0,
+            "stages": {
+                name: {
+                    "busy": stage.busy,
+                    "size": stage.size,
+                    "utilisation": stage.busy_time / (stage.size * uptime) if uptime else 0,
+                }
+                for name, stage in self.stages.items()
+            },
+        }
+
+scheduler = JobScheduler(WORKERS, TRANSFER_WORKERS, QUEUE_SIZE, USER_JOBS, ADMINS)
@@ -0,0 +1,131 @@
+#  This file is part of the VIDEOconvertor distribution.
+#  Copyright (c) 2021 vasusen-code ; All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 3.
+#
+#  This program is distributed in the hope that it will be useful, but
+#  WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+#  General Public License for more details.
+#
+#  License can be found in < https://github.com/vasusen-code/VIDEOconvertor/blob/public/LICENSE> .
+
+import os, random, asyncio
+
+from telethon.errors import RPCError, FloodWaitError
+from telethon.tl.functions.upload import SaveBigFilePartRequest
+from telethon.tl.types import InputFileBig
+
+from main.scheduler import scheduler
+
+PART = 512 * 1024
+# Telegram only takes files from 10 MB up as big files, the ones whose
+# parts may be sent in any order and without knowing the total yet
+BIG = 10 * 1024 * 1024
+# tries per part before the live upload is given up
+RETRIES = 5
+
+class LiveUpload:
+    """Uploads a file to Telegram while it is still being written.
+
+    Data given to `write` is appended to `path`, and every full 512 KB part is
+    sent as soon as it is on disk, with the part count left open (-1) until
+    the last one. `finish` returns the InputFile to send, or None when the file
+    stayed under 10 MB or a part could not be sent, and the finished file has
+    to be uploaded the usual way."""
+
+    def __init__(self, client, path, name, workers=4):
+        self.client = client
+        self.path = path
+        self.name = name
+        self.workers = workers
+        self.id = random.getrandbits(63)
+        self.written = 0
+        self.sent = 0
+        self.done = False
+        self._next = 0
+        self._file = open(path, "wb")
+        self._grown = asyncio.Condition()
+        self._task = None
+
+    async def write(self, chunk):
+        self._file.write(chunk)
+        self._file.flush()
+        async with self._grown:
+            self.written += len(chunk)
+            self._grown.notify_all()
+        if self._task is None and self.written >= BIG:
+            self._task = asyncio.ensure_future(self._upload())
+
+    @property
+    def parts(self):
+        return (self.written + PART - 1) // PART
+
+    def _ready(self):
+        # a part may go once data follows it, the last one carries the
+        # total and waits for the file to be done
+        return self.done or (self._next + 1) * PART < self.written
+
+    async def _upload(self):
+        workers = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            raise
+
+    async def _send(self, part, total, data):
+        for attempt in range(RETRIES):
+            try:
+                return await self.client(SaveBigFilePartRequest(self.id, part, total, data))
+            except FloodWaitError as e:
+                if attempt + 1 == RETRIES:
+                    raise
+                await asyncio.sleep(e.seconds)
+            except (RPCError, ConnectionError, OSError, asyncio.TimeoutError):
+                if attempt + 1 == RETRIES:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    async def _worker(self):
+        with open(self.path, "rb") as f:
+            while True:
+                async with self._grown:
+                    await self._grown.wait_for(self._ready)
+                    part = self._next
+                    if self.done and part >= self.parts:
+                        return
+                    self._next += 1
+                    total = self.parts if self.done else -1
+                f.seek(part * PART)
+                data = f.read(PART)
+                # a slot per part, not for the whole encode, so the
+                # transfers of other jobs go on between our parts
+                async with scheduler.stage("transfer"):
+                    await self._send(part, total, data)
+                self.sent += len(data)
+
+    async def finish(self):
+        """Waits for the remaining parts once the writer is done."""
+        self._file.close()
+        async with self._grown:
+            self.done = True
+            self._grown.notify_all()
+        if self._task is None:
+            return None
+        try:
+            await self._task
+        except Exception as e:
+            # the encode is fine, only this upload is lost
+            print(f"Live upload of {self.name} failed, uploading it again: {e}")
+            return None
+        return InputFileBig(self.id, self.parts, self.name)
+
+    def cancel(self):
+        if not self._file.closed:
+            self._file.close()
+        if self._task is not None:
+            self._task.cancel()